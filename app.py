@@ -792,15 +792,32 @@ if mod == "chat":
             hist = [{"role":x["role"],"content":x["content"]}
                     for x in st.session_state.msgs[:-1][-8:]]
             try:
-                res = process_q(query, hist, {"name": st.session_state.uname})
+                res = process_q(query, hist, {"name": st.session_state.uname}, stream=True)
             except Exception as e:
                 res = {"intent":"ERR","module":"general","label":"⚠️ Error",
                        "answer":f"Something went wrong: `{e}`","data":None,"rag_docs":[]}
-            ms = int((time.time()-t0)*1000)
 
         rm     = res.get("module","general")
         rl     = res.get("label","🧠 AI")
         intent = res.get("intent","")
+        if not isinstance(res["answer"], str):
+            # Streamed LLM answer: show tokens as they arrive, keep the assembled text
+            mm = {"jira":"mt-jira","hr":"mt-hr","data":"mt-data",
+                  "rag":"mt-rag","helpdesk":"mt-help"}.get(rm, "mt-ai")
+            st.markdown(f"""
+            <div class="msg-wrap">
+              <div class="msg-av bot">🤖</div>
+              <div class="msg-content">
+                <div class="msg-name">SuperBot &nbsp;<span class="mod-tag {mm}">{rl}</span></div>
+            """, unsafe_allow_html=True)
+            try:
+                res["answer"] = st.write_stream(res["answer"])
+            except Exception as e:
+                res["answer"] = f"Something went wrong: `{e}`"
+            st.markdown('</div></div>', unsafe_allow_html=True)
+            if not isinstance(res["answer"], str):
+                res["answer"] = "".join(str(x) for x in res["answer"])
+        ms = int((time.time()-t0)*1000)
         mcp_used = []
         if "JIRA"    in intent: mcp_used.append("jira_create" if "CREATE" in intent else "jira_update")
         if "DATA"    in intent: mcp_used.append("sql_query")
@@ -1052,7 +1069,7 @@ elif mod == "data":
 
 # ── KNOWLEDGE BASE ───────────────────────────────────────────
 elif mod == "kb":
-    from backend.rag_handler import get_indexed_sources, add_pdf, delete_source
+    from backend.rag_handler import get_indexed_sources, add_pdf, add_documents, delete_source, embed_cache_stats
 
     st.markdown('<div style="padding:24px 32px;max-width:1100px">',unsafe_allow_html=True)
     st.markdown("## 📚 Knowledge Base")
@@ -1064,15 +1081,32 @@ elif mod == "kb":
         ups = st.file_uploader("Drop files here",type=["pdf","txt","docx"],
                                accept_multiple_files=True,label_visibility="collapsed")
         if ups:
-            for f in ups:
-                with st.spinner(f"Indexing {f.name}…"):
-                    raw=f.read(); n=add_pdf(raw,f.name,"Uploaded Document")
+            raws={f.name:f.read() for f in ups}
+            bar=st.progress(0.0,text=f"Indexing {len(raws)} file(s)…")
+            if len(raws)==1:
+                # One file: stream it page by page
+                name,raw=next(iter(raws.items()))
+                def _prog(done,total,chunks):
+                    bar.progress(min(done/max(total,1),1.0),text=f"Indexing {name}… page {done}/{total} · {chunks} chunks")
+                counts={name:add_pdf(raw,name,"Uploaded Document",progress=_prog)}
+            else:
+                # Parsing is the first 30% of the bar, embedding the rest
+                def _prog(done,total,chunks,stage):
+                    frac=min(done/max(total,1),1.0)
+                    if stage=="files":
+                        bar.progress(0.3*frac,text=f"Parsing… {done}/{total} files · {chunks} chunks")
+                    else:
+                        bar.progress(0.3+0.7*frac,text=f"Embedding… {done}/{total} chunks")
+                counts=add_documents([(raw,name) for name,raw in raws.items()],"Uploaded Document",progress=_prog)
+            bar.empty()
+            for name,raw in raws.items():
+                n=counts.get(name,0)
                 if n>0:
                     dbx("INSERT OR IGNORE INTO documents(filename,file_type,file_size,uploaded_by,uploaded_at,chunk_count,status)VALUES(?,?,?,?,?,?,'indexed')",
-                        (f.name,f.name.split(".")[-1],len(raw),st.session_state.uname,datetime.now().isoformat(),n))
-                    audit("doc_upload","kb",f.name)
-                    st.success(f"✅ {f.name} — {n} chunks indexed")
-                else: st.warning(f"⚠️ Could not index {f.name}")
+                        (name,name.split(".")[-1],len(raw),st.session_state.uname,datetime.now().isoformat(),n))
+                    audit("doc_upload","kb",name)
+                    st.success(f"✅ {name} — {n} chunks indexed")
+                else: st.warning(f"⚠️ Could not index {name}")
 
         st.markdown("#### Indexed Documents")
         sources = get_indexed_sources()
@@ -1109,10 +1143,12 @@ elif mod == "kb":
 
         st.markdown("<br>")
         total_ch = sum(s["chunks"] for s in sources)
+        ec = embed_cache_stats()
         st.markdown(f"""
         <div style="background:rgba(255,255,255,.04);border:1px solid var(--border);border-radius:var(--r);padding:14px 16px">
           <div class="set-row" style="padding:6px 0"><span class="set-label" style="font-size:13px">Documents</span><span class="set-val">{len([s for s in sources if s['source']!='internal'])}</span></div>
           <div class="set-row" style="padding:6px 0"><span class="set-label" style="font-size:13px">Total Chunks</span><span class="set-val">{total_ch:,}</span></div>
+          <div class="set-row" style="padding:6px 0"><span class="set-label" style="font-size:13px">Embedding Cache</span><span class="set-val">{ec["hits"]:,} hits · {ec["misses"]:,} misses</span></div>
           <div class="set-row" style="padding:6px 0;border:none"><span class="set-label" style="font-size:13px">Vector Store</span><span style="color:#19c37d;font-size:13px;font-weight:600">NumPy RAG ✅</span></div>
         </div>""",unsafe_allow_html=True)
 
@@ -1175,6 +1211,30 @@ elif mod == "admin":
         with c2: st.metric("Positive Feedback",fb_pos)
         with c3: st.metric("Negative Feedback",fb_neg)
         with c4: st.metric("Satisfaction",f"{sat}%")
+        from backend.answer_cache import stats as answer_cache_stats
+        acs = answer_cache_stats()
+        st.markdown("**Answer Cache**")
+        a1,a2,a3,a4 = st.columns(4)
+        with a1: st.metric("Hit Rate",f"{acs['hit_rate']*100:.0f}%")
+        with a2: st.metric("Hits",acs["hits"])
+        with a3: st.metric("Misses",acs["misses"])
+        with a4: st.metric("Cached Answers",acs["size"],help=f"Invalidated {acs['invalidations']}× by index changes")
+        from backend.llm_handler import breaker_state
+        bs = breaker_state()
+        st.markdown("**LLM Provider**")
+        b1,b2,b3 = st.columns(3)
+        with b1: st.metric("Circuit Breaker","Open" if bs["open"] else "Closed",
+                           help="While open, chat answers use the knowledge-base fallback instead of calling the LLM")
+        with b2: st.metric("Consecutive Failures",bs["failures"])
+        with b3: st.metric("Retry In",f"{bs['retry_in']:.0f}s" if bs["open"] else "—")
+        from backend.rag_handler import query_cache_stats
+        qcs = query_cache_stats()
+        st.markdown("**Retrieval Caches**")
+        r1,r2,r3,r4 = st.columns(4)
+        with r1: st.metric("Query Vector Hit Rate",f"{qcs['vectors']['hit_rate']*100:.0f}%",help=f"{qcs['vectors']['size']} vectors cached")
+        with r2: st.metric("Result Hit Rate",f"{qcs['results']['hit_rate']*100:.0f}%",help=f"{qcs['results']['size']} result sets cached")
+        with r3: st.metric("Result Hits",qcs["results"]["hits"])
+        with r4: st.metric("Index Version",qcs["index_version"],help="Bumped by every index write; cached results of older versions are not reused")
         ac1_,ac2_ = st.columns(2)
         with ac1_:
             st.markdown("**Queries by Module**")
@@ -1288,10 +1348,9 @@ elif mod == "settings":
         if st.button("🔄 Rebuild Index",use_container_width=True):
             with st.spinner("Rebuilding…"):
                 try:
-                    from backend.rag_handler import init
-                    idx=os.path.join(os.path.dirname(__file__),"data/rag_index.pkl")
-                    if os.path.exists(idx): os.remove(idx)
-                    init(); st.success("Done!")
+                    from backend.rag_handler import rebuild
+                    r=rebuild()
+                    st.success(f"Done! {len(r['added'])} added · {len(r['updated'])} updated · {len(r['removed'])} removed · {r['unchanged']} unchanged")
                 except Exception as e: st.error(str(e))
 
     st.markdown('</div>',unsafe_allow_html=True)
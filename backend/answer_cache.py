@@ -0,0 +1,136 @@
+"""
+Answer Cache — semantic cache of LLM answers to knowledge-base questions.
+A query reuses a cached answer when
+  - it was asked with the same prompt ("kind": intent + system prompt) after the same recent
+    conversation (the chat history window llm_handler sends along),
+  - retrieval returned exactly the same chunks for it (same text, same sources), and
+  - its embedding is within ANSWER_CACHE_THRESHOLD (cosine) of the cached query.
+Entries expire after ANSWER_CACHE_TTL seconds, the least recently used one is evicted past
+ANSWER_CACHE_SIZE, and the whole cache is dropped when the RAG index version changes.
+"""
+import os, sys, json, threading, time, itertools
+from collections import OrderedDict
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import ANSWER_CACHE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+from backend import rag_cache
+
+class SemanticCache:
+    """Thread-safe LRU/TTL cache looked up by nearest query vector within a group key."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 0, threshold: float = 0.9):
+        self.maxsize, self.ttl, self.threshold = maxsize, ttl, threshold
+        self._data = OrderedDict()   # id -> (group, vec, value, stored_at)
+        self._groups = {}            # group -> [id, ...]
+        self._ids = itertools.count()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._data:
+                self.invalidations += 1
+            self._data.clear()
+            self._groups.clear()
+            self._version = version
+
+    def _drop(self, i):
+        group = self._data.pop(i)[0]
+        ids = self._groups[group]
+        ids.remove(i)
+        if not ids:
+            del self._groups[group]
+
+    def get(self, group, vec, version):
+        """(value, similarity) of the closest live entry in `group`, or None."""
+        with self._lock:
+            self._check_version(version)
+            now = time.monotonic()
+            best, best_sim = None, self.threshold
+            for i in list(self._groups.get(group, ())):
+                _, v, _, t = self._data[i]
+                if self.ttl and now - t >= self.ttl:
+                    self._drop(i)
+                    continue
+                sim = float(v @ vec)
+                if sim >= best_sim:
+                    best, best_sim = i, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best)
+            self.hits += 1
+            return self._data[best][2], best_sim
+
+    def put(self, group, vec, version, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            i = next(self._ids)
+            self._data[i] = (group, np.asarray(vec, dtype=np.float32), value, time.monotonic())
+            self._groups.setdefault(group, []).append(i)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._groups.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+_cache = SemanticCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD)
+
+def _chunks_key(docs: list) -> tuple:
+    return tuple(sorted(rag_cache.text_hash(f"{d['metadata'].get('source', '')}\0{d['text']}") for d in docs))
+
+def _history_key(history: list) -> str:
+    from backend import llm_handler as llm
+    window = [[m["role"], m["content"]] for m in (history or [])[-llm.HISTORY_TURNS:]]
+    return rag_cache.text_hash(json.dumps(window, ensure_ascii=False))
+
+def answer(kind: str, query: str, docs: list, generate, history: list = None) -> tuple:
+    """(answer, citations, cached) for `query` given the retrieved `docs`. On a miss the answer
+    is `generate()`, stored if llm_handler.cacheable(); a streamed answer (an
+    iterator of text pieces) is passed through and stored once fully consumed. `kind` separates prompts
+    that would answer the same query differently and `history` is the chat history the prompt
+    includes; queries that retrieved nothing bypass the cache."""
+    if not ANSWER_CACHE or not docs:
+        return generate(), docs, False
+    from backend import rag_handler as rag, llm_handler as llm
+    version, vec = rag.index_version(), rag.query_vector(query)
+    group = (kind, _chunks_key(docs), _history_key(history))
+    hit = _cache.get(group, vec, version)
+    if hit is not None:
+        ans, cited = hit[0]
+        return ans, cited, True
+    ans = generate()
+    if not isinstance(ans, str):
+        return _store_when_done(ans, group, vec, version, docs), docs, False
+    if llm.cacheable(ans):
+        _cache.put(group, vec, version, (ans, docs))
+    return ans, docs, False
+
+def _store_when_done(pieces, group, vec, version, docs):
+    """Pass a streamed answer through, caching the assembled text once it is complete."""
+    from backend import llm_handler as llm
+    parts = []
+    for piece in pieces:
+        parts.append(piece)
+        yield piece
+    ans = "".join(parts)
+    if llm.cacheable(ans):
+        _cache.put(group, vec, version, (ans, docs))
+
+def stats() -> dict:
+    return _cache.stats()
+
+def clear():
+    _cache.clear()
@@ -0,0 +1,182 @@
+"""
+Embedding Worker — one local process per host that owns the SentenceTransformer.
+Server processes send batches of texts over a local socket (RAG_EMBED_WORKER) and get
+float32 vectors back. Requests arriving within RAG_EMBED_WORKER_WAIT_MS of each other are
+coalesced into a single encoder call, so the model is loaded once and runs at batch size
+even when every session sends one query at a time.
+
+Run it yourself with `python -m backend.embed_worker`, or let rag_handler start it on
+first use (RAG_EMBED_WORKER_AUTOSTART).
+Protocol (multiprocessing.connection, which pickles messages, so only holders of the key
+may connect: RAG_EMBED_WORKER_KEY, or a random key generated once into KEY_FILE, mode 0600):
+  request  ("embed", model_name, [text, ...])
+  reply    ("ok", float32 ndarray (n, dim))  |  ("error", message)
+"""
+import os, sys, time, queue, secrets, threading, subprocess
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import (
+    EMBEDDING_MODEL, RAG_EMBED_WORKER, RAG_EMBED_WORKER_KEY, RAG_EMBED_WORKER_TIMEOUT,
+    RAG_EMBED_WORKER_WAIT_MS, RAG_EMBED_WORKER_MAX_BATCH
+)
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+# A plain path is a Unix socket relative to the project; \\.\pipe\... names pass through (Windows)
+ADDRESS = RAG_EMBED_WORKER if RAG_EMBED_WORKER.startswith("\\\\") else os.path.join(ROOT, RAG_EMBED_WORKER)
+KEY_FILE = os.path.join(ROOT, "data", "embed_worker.key")
+_key = None
+_local = threading.local()
+_start_lock = threading.Lock()
+
+def _auth() -> bytes:
+    """RAG_EMBED_WORKER_KEY, else this install's random key (created on first use, owner-only)."""
+    global _key
+    if _key is None:
+        if RAG_EMBED_WORKER_KEY:
+            _key = RAG_EMBED_WORKER_KEY.encode()
+        else:
+            if not os.path.exists(KEY_FILE):
+                os.makedirs(os.path.dirname(KEY_FILE), exist_ok=True)
+                tmp = f"{KEY_FILE}.{os.getpid()}.tmp"
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "w") as f:
+                    f.write(secrets.token_hex(32))
+                try:
+                    os.link(tmp, KEY_FILE)   # atomic, and the first process to get here wins
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(tmp)
+            with open(KEY_FILE) as f:
+                _key = f.read().strip().encode()
+    return _key
+
+# ── Client ────────────────────────────────────────────────────────────────────
+
+def embed(texts: list, model: str = EMBEDDING_MODEL):
+    """Raw float32 vectors for `texts` from the worker. Raises OSError/EOFError when no
+    worker is reachable and RuntimeError when it refused the request or did not answer
+    within RAG_EMBED_WORKER_TIMEOUT."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        try:
+            conn = _local.conn = Client(ADDRESS, authkey=_auth())
+        except AuthenticationError as e:
+            raise RuntimeError(f"embedding worker: {e}")
+    try:
+        conn.send(("embed", model, list(texts)))
+        if not conn.poll(RAG_EMBED_WORKER_TIMEOUT or None):
+            raise TimeoutError(f"no reply within {RAG_EMBED_WORKER_TIMEOUT:g}s")
+        status, payload = conn.recv()
+    except (OSError, EOFError) as e:
+        _local.conn = None
+        conn.close()   # a late reply must not be read as the answer to the next request
+        if isinstance(e, TimeoutError):
+            raise RuntimeError(f"embedding worker: {e}")
+        raise
+    if status != "ok":
+        raise RuntimeError(f"embedding worker: {payload}")
+    return payload
+
+def running() -> bool:
+    try:
+        Client(ADDRESS, authkey=_auth()).close()
+        return True
+    except (OSError, EOFError, AuthenticationError):
+        return False
+
+def start(wait: float = 120) -> bool:
+    """Spawn a detached worker unless one is already listening; wait until it accepts."""
+    with _start_lock:
+        if running():
+            return True
+        print(f"Embedding worker: starting on {ADDRESS}")
+        subprocess.Popen([sys.executable, "-m", "backend.embed_worker"], cwd=ROOT,
+                         start_new_session=True, stdin=subprocess.DEVNULL)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.25)
+            if running():
+                return True
+        return False
+
+# ── Server ────────────────────────────────────────────────────────────────────
+
+def _batcher(model, jobs: queue.Queue):
+    """Drain queued requests into one encoder call of up to RAG_EMBED_WORKER_MAX_BATCH texts."""
+    while True:
+        batch = [jobs.get()]
+        n = len(batch[0]["texts"])
+        deadline = time.monotonic() + RAG_EMBED_WORKER_WAIT_MS / 1000
+        while n < RAG_EMBED_WORKER_MAX_BATCH:
+            try:
+                job = jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(job)
+            n += len(job["texts"])
+        try:
+            vecs = np.asarray(model.encode([t for job in batch for t in job["texts"]],
+                                           show_progress_bar=False), dtype=np.float32)
+            off = 0
+            for job in batch:
+                job["reply"] = ("ok", vecs[off:off + len(job["texts"])])
+                off += len(job["texts"])
+        except Exception as e:
+            for job in batch:
+                job["reply"] = ("error", str(e))
+        for job in batch:
+            job["done"].set()
+
+def _serve_client(conn, jobs: queue.Queue):
+    with conn:
+        while True:
+            try:
+                op, model, texts = conn.recv()
+            except (OSError, EOFError):
+                return
+            if op != "embed" or model != EMBEDDING_MODEL:
+                conn.send(("error", f"worker serves {EMBEDDING_MODEL!r}, got {op} {model!r}"))
+                continue
+            if not texts:
+                conn.send(("ok", np.zeros((0, 0), dtype=np.float32)))
+                continue
+            job = {"texts": texts, "done": threading.Event(), "reply": None}
+            jobs.put(job)
+            job["done"].wait()
+            conn.send(job["reply"])
+
+def serve():
+    if running():
+        print(f"Embedding worker: already running on {ADDRESS}")
+        return
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    if running():   # another worker finished loading first
+        return
+    if not ADDRESS.startswith("\\\\") and os.path.exists(ADDRESS):
+        os.remove(ADDRESS)   # stale socket from a worker that died
+    os.makedirs(os.path.dirname(ADDRESS) or ".", exist_ok=True)
+    try:
+        listener = Listener(ADDRESS, authkey=_auth())
+    except OSError as e:
+        print(f"Embedding worker: cannot listen on {ADDRESS} ({e})")
+        return
+    if not ADDRESS.startswith("\\\\"):
+        os.chmod(ADDRESS, 0o600)
+    jobs = queue.Queue()
+    threading.Thread(target=_batcher, args=(model, jobs), name="embed-batcher", daemon=True).start()
+    print(f"Embedding worker: {EMBEDDING_MODEL} ready on {ADDRESS}")
+    with listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"Embedding worker: rejected connection ({e})")
+                continue
+            threading.Thread(target=_serve_client, args=(conn, jobs), daemon=True).start()
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,70 @@
+"""
+HTTP Pool — keep-alive connections to one base URL, shared by every thread in the process.
+Standard library only (http.client). A connection goes back to the pool once its response
+has been read to the end, so the next request skips DNS, TCP and TLS setup; at most `size`
+requests are in flight at once. A reused connection that the server has meanwhile closed is
+replaced and the request retried once.
+"""
+import json, queue, threading, http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+_STALE = (http.client.RemoteDisconnected, http.client.CannotSendRequest, BrokenPipeError, ConnectionResetError)
+
+class HTTPPool:
+    def __init__(self, base_url: str, size: int = 10, timeout: float = 15):
+        u = urlsplit(base_url)
+        self.host, self.prefix, self.timeout = u.netloc, u.path.rstrip("/"), timeout
+        self._cls = http.client.HTTPSConnection if u.scheme == "https" else http.client.HTTPConnection
+        self._idle = queue.LifoQueue()   # most recently used first: likeliest to still be open
+        self._slots = threading.BoundedSemaphore(size)
+        self.opened = 0
+
+    def _get(self, timeout: float):
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._cls(self.host, timeout=timeout), False
+            self.opened += 1
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, reused
+
+    @contextmanager
+    def post_json(self, path: str, payload: dict, headers: dict = None, timeout: float = None):
+        """POST `payload` as JSON to base_url + path and yield the http.client.HTTPResponse.
+        The body may be read whole or streamed line by line inside the block."""
+        body = json.dumps(payload).encode("utf-8")
+        hdrs = {"Content-Type": "application/json", "Connection": "keep-alive", **(headers or {})}
+        with self._slots:
+            for attempt in (0, 1):
+                conn, reused = self._get(timeout or self.timeout)
+                try:
+                    conn.request("POST", self.prefix + path, body, hdrs)
+                    resp = conn.getresponse()
+                    break
+                except _STALE:
+                    conn.close()
+                    if not reused or attempt:
+                        raise
+                except Exception:
+                    conn.close()
+                    raise
+            try:
+                yield resp
+            except BaseException:
+                conn.close()
+                raise
+            if resp.isclosed() and not resp.will_close:
+                self._idle.put(conn)
+            else:
+                resp.close()
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,208 @@
+"""
+LLM Async — one asyncio event loop (a daemon thread) in front of the LLM API.
+  limiter     at most LLM_MAX_CONCURRENCY upstream calls at once; size it to the provider's
+              rate limit. Up to LLM_QUEUE_MAX callers wait for a slot; beyond that, or
+              after LLM_QUEUE_TIMEOUT seconds of waiting, a call fails fast with LLMBusy
+              instead of piling up blocked threads
+  coalescing  identical in-flight requests (messages, temperature, max_tokens) share one
+              upstream call and all receive its result; once every caller has given up
+              (latency budget), the call is cancelled and frees its slot
+Upstream calls use groq.AsyncGroq when the package is installed, otherwise the blocking
+stdlib HTTP pool of llm_handler on a thread per slot.
+Async code awaits complete(); sync callers (llm_handler.call_llm, generate_sql) use
+complete_sync(); streamed answers hold a limiter slot through slot() but are not coalesced.
+"""
+import os, sys, json, asyncio, threading, functools, concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import (
+    LLM_TEMPERATURE, LLM_MAX_TOKENS, LLM_TIMEOUT, LLM_POOL_SIZE,
+    LLM_MAX_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT, GROQ_API_KEY, GROQ_BASE_URL
+)
+
+class LLMBusy(RuntimeError):
+    """The limiter's wait queue is full, or no slot freed up within LLM_QUEUE_TIMEOUT."""
+
+_loop = None
+_loop_lock = threading.Lock()
+# Everything below is only touched from the loop thread, so it needs no locks
+_sem = None
+_waiting = 0
+_inflight = {}        # request key -> {"task": the shared upstream call, "waiters": callers awaiting it}
+_client = None        # AsyncGroq, False when the groq package is missing
+_executor = None
+_stats = {"upstream": 0, "coalesced": 0, "rejected": 0, "cancelled": 0}
+
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-async", daemon=True).start()
+            _loop = loop
+        return _loop
+
+def _semaphore() -> asyncio.Semaphore:
+    global _sem
+    if _sem is None:
+        _sem = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _sem
+
+async def _acquire():
+    global _waiting
+    sem = _semaphore()
+    if sem.locked() and _waiting >= LLM_QUEUE_MAX:
+        _stats["rejected"] += 1
+        raise LLMBusy(f"{_waiting} requests already waiting for one of {LLM_MAX_CONCURRENCY} LLM slots")
+    _waiting += 1
+    try:
+        await asyncio.wait_for(sem.acquire(), LLM_QUEUE_TIMEOUT or None)
+    except asyncio.TimeoutError:
+        _stats["rejected"] += 1
+        raise LLMBusy(f"no LLM slot free within {LLM_QUEUE_TIMEOUT:g}s")
+    finally:
+        _waiting -= 1
+
+def _async_client():
+    global _client
+    if _client is None:
+        try:
+            import httpx
+            from groq import AsyncGroq
+            _client = AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=LLM_TIMEOUT,
+                                http_client=httpx.AsyncClient(limits=httpx.Limits(
+                                    max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE)))
+        except ImportError:
+            _client = False
+    return _client
+
+async def _upstream(messages, temperature, max_tokens, timeout, retries=True):
+    """One provider call. Its outcome goes to llm_handler's circuit breaker here, once, however
+    many callers share it; time spent queued for a slot is never counted against the provider.
+    `retries=False` (caller under a latency budget) disables the groq client's own retries."""
+    from backend import llm_handler as llm
+    global _executor
+    await _acquire()
+    release = True
+    try:
+        _stats["upstream"] += 1
+        client = _async_client()
+        if client:
+            if not retries:
+                client = client.with_options(max_retries=0)   # a retry would overrun the budget
+            try:
+                resp = await client.chat.completions.create(
+                    **llm._payload(messages, temperature, max_tokens), timeout=timeout or LLM_TIMEOUT)
+                result = resp.choices[0].message.content
+            except Exception as e:
+                print(f"LLM error: {e}")
+                result = None
+        else:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(LLM_MAX_CONCURRENCY, thread_name_prefix="llm-http")
+            call = asyncio.get_running_loop().run_in_executor(
+                _executor, functools.partial(llm._call_http, messages, temperature, max_tokens, timeout))
+            try:
+                result = await asyncio.shield(call)
+            except asyncio.CancelledError:
+                # The HTTP thread can't be interrupted; it keeps the slot until it returns
+                release = False
+                call.add_done_callback(lambda _: _semaphore().release())
+                raise
+        llm._record(result is not None)
+        return result
+    except asyncio.CancelledError:
+        _stats["cancelled"] += 1
+        llm._record(False)   # the provider was still working when every caller's budget ran out
+        raise
+    finally:
+        if release:
+            _semaphore().release()
+
+async def _complete(messages, temperature, max_tokens, timeout, retries=True):
+    key = json.dumps([messages, temperature or LLM_TEMPERATURE, max_tokens or LLM_MAX_TOKENS], sort_keys=True)
+    entry = _inflight.get(key)
+    if entry is None:
+        entry = _inflight[key] = {"task": asyncio.ensure_future(
+            _upstream(messages, temperature, max_tokens, timeout, retries)), "waiters": 0}
+        entry["task"].add_done_callback(lambda f: _forget(key, entry))
+    else:
+        _stats["coalesced"] += 1
+    entry["waiters"] += 1
+    try:
+        return await asyncio.shield(entry["task"])   # one caller giving up does not cancel the shared call
+    finally:
+        entry["waiters"] -= 1
+        if not entry["waiters"] and not entry["task"].done():
+            entry["task"].cancel()   # ...but the last one does: nobody would read the answer
+            _forget(key, entry)
+
+def _forget(key, entry):
+    if _inflight.get(key) is entry:
+        del _inflight[key]
+
+async def complete(messages, temperature=None, max_tokens=None, timeout=None, retries=True):
+    """Completion text (None on upstream error); raises LLMBusy. Usable from any event loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+        _complete(messages, temperature, max_tokens, timeout, retries), _get_loop()))
+
+def complete_sync(messages, temperature=None, max_tokens=None, timeout=None, retries=True):
+    """Blocking complete() for threads outside the loop. Waits at most `timeout` seconds in
+    total (queue + call), then cancels this caller's wait and raises
+    concurrent.futures.TimeoutError."""
+    fut = asyncio.run_coroutine_threadsafe(
+        _complete(messages, temperature, max_tokens, timeout, retries), _get_loop())
+    try:
+        return fut.result(timeout)
+    except concurrent.futures.TimeoutError:
+        fut.cancel()
+        raise
+
+def _start_acquire(fut, state):
+    """Loop thread: run _acquire() for a sync caller and resolve `fut` with the outcome. A
+    permit that is acquired after the caller gave up is released again at once."""
+    def done(task):
+        acquired = not task.cancelled() and task.exception() is None
+        if state.get("abandoned"):
+            if acquired:
+                _semaphore().release()
+            return
+        state["resolved"] = acquired
+        if task.cancelled():
+            fut.cancel()
+        elif task.exception() is not None:
+            fut.set_exception(task.exception())
+        else:
+            fut.set_result(None)
+    state["task"] = asyncio.ensure_future(_acquire())
+    state["task"].add_done_callback(done)
+
+def _abandon(state):
+    """Loop thread: the sync caller stopped waiting for its slot."""
+    if state.get("resolved"):
+        _semaphore().release()   # acquired, but the caller had already timed out
+    else:
+        state["abandoned"] = True
+        state["task"].cancel()   # no-op if it already finished; done() then releases
+
+@contextmanager
+def slot(timeout: float = None):
+    """Hold one limiter slot from a sync thread for the duration of the block; waiting longer
+    than `timeout` raises concurrent.futures.TimeoutError."""
+    loop, fut, state = _get_loop(), concurrent.futures.Future(), {}
+    loop.call_soon_threadsafe(_start_acquire, fut, state)
+    try:
+        fut.result(timeout)
+    except concurrent.futures.TimeoutError:
+        loop.call_soon_threadsafe(_abandon, state)
+        raise
+    try:
+        yield
+    finally:
+        loop.call_soon_threadsafe(_semaphore().release)
+
+def stats() -> dict:
+    s = dict(_stats)
+    s.update(in_flight=len(_inflight), waiting=_waiting)
+    return s
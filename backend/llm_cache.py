@@ -0,0 +1,74 @@
+"""
+LLM Cache — persistent response cache for deterministic LLM calls, in the app database.
+Keyed by sha256 of (model, messages, temperature, max_tokens). Entries older than
+LLM_CACHE_TTL are ignored and purged; beyond LLM_CACHE_MAX_ENTRIES the least recently used
+are evicted. Opt-in per call site (LLM_CACHE_SQL, LLM_CACHE_JIRA_EXTRACT,
+LLM_CACHE_HELPDESK_EXTRACT); callers pass cache=True to llm_handler.call_llm / _complete.
+"""
+import os, sys, json, sqlite3, hashlib, threading, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import SQLITE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES
+
+DB = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", SQLITE_PATH))
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def _conn():
+    os.makedirs(os.path.dirname(DB), exist_ok=True)
+    conn = sqlite3.connect(DB, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS llm_response_cache ("
+                 "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+                 "created_at REAL NOT NULL, used_at REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_used ON llm_response_cache (used_at)")
+    return conn
+
+def key(model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    payload = json.dumps([model, messages, temperature, max_tokens], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get(k: str):
+    """Cached response for key `k`, or None if absent or expired."""
+    now = time.time()
+    conn = _conn()
+    try:
+        row = conn.execute("SELECT response, created_at FROM llm_response_cache WHERE key=?", (k,)).fetchone()
+        if row and LLM_CACHE_TTL and now - row[1] >= LLM_CACHE_TTL:
+            conn.execute("DELETE FROM llm_response_cache WHERE key=?", (k,))
+            row = None
+        elif row:
+            conn.execute("UPDATE llm_response_cache SET used_at=? WHERE key=?", (now, k))
+        conn.commit()
+    finally:
+        conn.close()
+    with _stats_lock:
+        _stats["hits" if row else "misses"] += 1
+    return row[0] if row else None
+
+def put(k: str, model: str, response: str):
+    now = time.time()
+    conn = _conn()
+    try:
+        conn.execute("INSERT OR REPLACE INTO llm_response_cache (key, model, response, created_at, used_at) "
+                     "VALUES (?,?,?,?,?)", (k, model, response, now, now))
+        if LLM_CACHE_TTL:
+            conn.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+        conn.execute("DELETE FROM llm_response_cache WHERE key IN (SELECT key FROM llm_response_cache "
+                     "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (max(LLM_CACHE_MAX_ENTRIES, 0),))
+        conn.commit()
+    finally:
+        conn.close()
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    total = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / total, 3) if total else 0.0
+    return s
+
+def clear():
+    conn = _conn()
+    try:
+        conn.execute("DELETE FROM llm_response_cache")
+        conn.commit()
+    finally:
+        conn.close()
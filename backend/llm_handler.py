@@ -1,9 +1,16 @@
-import os, sys, re
+import os, sys, re, json, time, threading, contextvars, concurrent.futures
+from contextlib import contextmanager, nullcontext, ExitStack
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 from config.settings import (
-    LLM_BACKEND, LLM_TEMPERATURE, LLM_MAX_TOKENS,
-    GROQ_API_KEY, GROQ_MODEL, COMPANY_NAME
+    LLM_BACKEND, LLM_TEMPERATURE, LLM_MAX_TOKENS, LLM_TIMEOUT, LLM_POOL_SIZE, LLM_ASYNC, LLM_CACHE_SQL,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN,
+    GROQ_API_KEY, GROQ_MODEL, GROQ_BASE_URL, COMPANY_NAME
 )
+from backend.http_pool import HTTPPool
+from backend import rag_pack
+from backend.llm_async import LLMBusy
+
+HISTORY_TURNS = 6   # most recent chat messages sent along with each prompt
 
 SYSTEM_PROMPT = f"""You are SuperBot, the intelligent enterprise AI assistant for {COMPANY_NAME}.
 You help employees with HR policies, Jira tracking, data analytics, IT support, and general questions.
@@ -11,58 +18,278 @@ Be concise, helpful, and professional. Use the context provided to give accurate
 When context is from HR documents, quote the relevant policy sections precisely.
 When writing SQL, use proper T-SQL/Azure Synapse syntax."""
 
-def _call_groq(messages, temperature=None, max_tokens=None):
-    """Call Groq API - tries groq package first, then requests HTTP."""
-    temp = temperature or LLM_TEMPERATURE
-    mtok = max_tokens or LLM_MAX_TOKENS
-    # Try groq package
+_groq = None          # groq.Groq, created on first call; its httpx pool keeps connections alive
+_http = None          # HTTPPool fallback when the groq package is not installed
+_client_lock = threading.Lock()
+_deadline = contextvars.ContextVar("llm_deadline", default=None)   # time.monotonic() to answer by
+_breaker = {"failures": 0, "open_until": 0.0}   # consecutive provider failures, skip-until time
+_breaker_lock = threading.Lock()
+MIN_CALL_TIME = 0.5   # seconds; with less budget left, go straight to the fallback
+
+# ── Deadlines / circuit breaker ───────────────────────────────────────────────
+
+@contextmanager
+def deadline(seconds: float):
+    """Latency budget shared by every LLM call made inside the block (0/None = no budget).
+    Calls are given only the time that is left and skipped once it is spent."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def _breaker_allows() -> bool:
+    """Closed: call. Open: skip until the cool-down ends, then let one probe call through."""
+    with _breaker_lock:
+        if not LLM_BREAKER_FAILURES or _breaker["failures"] < LLM_BREAKER_FAILURES:
+            return True
+        now = time.monotonic()
+        if now < _breaker["open_until"]:
+            return False
+        _breaker["open_until"] = now + LLM_BREAKER_COOLDOWN   # others keep skipping during the probe
+        return True
+
+def _record(ok: bool):
+    with _breaker_lock:
+        if ok:
+            _breaker["failures"], _breaker["open_until"] = 0, 0.0
+            return
+        _breaker["failures"] += 1
+        if LLM_BREAKER_FAILURES and _breaker["failures"] >= LLM_BREAKER_FAILURES:
+            _breaker["open_until"] = time.monotonic() + LLM_BREAKER_COOLDOWN
+            print(f"LLM: {_breaker['failures']} failures in a row, skipping the provider for {LLM_BREAKER_COOLDOWN:g}s")
+
+def _budget(timeout: float = None):
+    """Timeout for the next call: `timeout` (or LLM_TIMEOUT) capped by the remaining deadline.
+    None means use the fallback: the budget is spent or the circuit breaker is open."""
+    t = timeout or LLM_TIMEOUT
+    end = _deadline.get()
+    if end is not None:
+        t = min(t, end - time.monotonic())
+    if t < MIN_CALL_TIME or not _breaker_allows():
+        return None
+    return t
+
+def breaker_state() -> dict:
+    """Consecutive provider failures, whether calls are being skipped, and for how much longer."""
+    with _breaker_lock:
+        left = _breaker["open_until"] - time.monotonic()
+        return {"failures": _breaker["failures"], "open": left > 0, "retry_in": max(0.0, left)}
+
+# ── Transport ─────────────────────────────────────────────────────────────────
+
+def _groq_client():
+    """The process-wide Groq client (ImportError without the groq package)."""
+    global _groq
+    with _client_lock:
+        if _groq is None:
+            import httpx
+            from groq import Groq
+            _groq = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=LLM_TIMEOUT,
+                         http_client=httpx.Client(limits=httpx.Limits(max_connections=LLM_POOL_SIZE,
+                                                                      max_keepalive_connections=LLM_POOL_SIZE)))
+        return _groq
+
+def _http_pool() -> HTTPPool:
+    global _http
+    with _client_lock:
+        if _http is None:
+            _http = HTTPPool(GROQ_BASE_URL, LLM_POOL_SIZE, LLM_TIMEOUT)
+        return _http
+
+def _payload(messages, temperature, max_tokens, **extra) -> dict:
+    return {"model": GROQ_MODEL, "messages": messages, "temperature": temperature or LLM_TEMPERATURE,
+            "max_tokens": max_tokens or LLM_MAX_TOKENS, **extra}
+
+_AUTH = {"Authorization": f"Bearer {GROQ_API_KEY}"}
+_PATH = "/openai/v1/chat/completions"
+
+def _call_groq(messages, temperature=None, max_tokens=None, timeout=None):
+    """Call Groq API over the shared client - groq package first, then the stdlib HTTP pool.
+    `timeout` (seconds) overrides LLM_TIMEOUT for this call."""
     try:
-        from groq import Groq
-        resp = Groq(api_key=GROQ_API_KEY).chat.completions.create(
-            model=GROQ_MODEL, messages=messages, temperature=temp, max_tokens=mtok)
+        client = _groq_client()
+        if _deadline.get() is not None:
+            client = client.with_options(max_retries=0)   # a retry would overrun the budget
+        resp = client.chat.completions.create(
+            **_payload(messages, temperature, max_tokens), timeout=timeout or LLM_TIMEOUT)
         return resp.choices[0].message.content
     except ImportError:
-        pass
-    # Try requests HTTP
+        return _call_http(messages, temperature, max_tokens, timeout)
+    except Exception as e:
+        print(f"LLM error: {e}")
+        return None
+
+def _call_http(messages, temperature=None, max_tokens=None, timeout=None):
+    """Chat completion over the stdlib HTTP pool (no groq package)."""
     try:
-        import requests, json
-        resp = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
-            json={"model": GROQ_MODEL, "messages": messages, "temperature": temp, "max_tokens": mtok},
-            timeout=15
-        )
-        if resp.status_code == 200:
-            return resp.json()["choices"][0]["message"]["content"]
-    except:
-        pass
+        with _http_pool().post_json(_PATH, _payload(messages, temperature, max_tokens), _AUTH, timeout) as resp:
+            body = resp.read()
+        if resp.status == 200:
+            return json.loads(body)["choices"][0]["message"]["content"]
+        print(f"LLM error: HTTP {resp.status} {body[:200]!r}")
+    except Exception as e:
+        print(f"LLM error: {e}")
     return None
 
-def call_llm(user_query: str, context: str = "", chat_history: list = None, system_override: str = None) -> str:
+def _complete(messages, temperature=None, max_tokens=None, timeout=None, cache=False):
+    """Blocking completion; with LLM_ASYNC it goes through llm_async's limiter and coalescing.
+    `cache` serves repeats of the exact same request from llm_cache (the app database).
+    Returns None (caller falls back) when the budget is spent, the breaker is open or the call fails."""
+    if cache:
+        from backend import llm_cache
+        k = llm_cache.key(GROQ_MODEL, messages, temperature or LLM_TEMPERATURE, max_tokens or LLM_MAX_TOKENS)
+        hit = llm_cache.get(k)
+        if hit is not None:
+            return hit
+    t = _budget(timeout)
+    if t is None:
+        return None
+    if not LLM_ASYNC:
+        result = _call_groq(messages, temperature, max_tokens, t)
+        _record(result is not None)
+    else:
+        # llm_async records each upstream call's outcome itself: once per coalesced group,
+        # and not at all for a request whose budget ran out while it was still queued
+        from backend import llm_async
+        try:
+            result = llm_async.complete_sync(messages, temperature, max_tokens, t,
+                                             retries=_deadline.get() is None)
+        except LLMBusy as e:
+            print(f"LLM busy: {e}")
+            return None
+        except concurrent.futures.TimeoutError:
+            print(f"LLM call cancelled after {t:.1f}s (latency budget)")
+            return None
+    if cache and result:
+        llm_cache.put(k, GROQ_MODEL, result)
+    return result
+
+def _stream_groq(messages, temperature=None, max_tokens=None, timeout=None):
+    """Yield completion text as it is generated - groq package first, then SSE over the HTTP pool."""
+    try:
+        client = _groq_client()
+    except ImportError:
+        client = None
+    if client is not None:
+        stream = client.chat.completions.create(
+            **_payload(messages, temperature, max_tokens), stream=True, timeout=timeout or LLM_TIMEOUT)
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        return
+    with _http_pool().post_json(_PATH, _payload(messages, temperature, max_tokens, stream=True),
+                                _AUTH, timeout) as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status} {resp.read()[:200]!r}")
+        for raw in resp:
+            line = raw.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                resp.read()   # drain to the end so the connection can be reused
+                return
+            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+def _messages(user_query: str, context: str, chat_history: list, system_override: str) -> list:
     messages = [{"role": "system", "content": system_override or SYSTEM_PROMPT}]
     if chat_history:
-        for m in chat_history[-6:]:
+        for m in chat_history[-HISTORY_TURNS:]:
             messages.append({"role": m["role"], "content": m["content"]})
     content = f"{context}\n\nUser: {user_query}" if context else user_query
     messages.append({"role": "user", "content": content})
+    return messages
+
+def call_llm(user_query: str, context: str = "", chat_history: list = None, system_override: str = None,
+             timeout: float = None, cache: bool = False) -> str:
+    messages = _messages(user_query, context, chat_history, system_override)
     if LLM_BACKEND == "groq" and GROQ_API_KEY:
-        result = _call_groq(messages)
+        result = _complete(messages, timeout=timeout, cache=cache)
         if result:
             return result
-    return _mock(user_query)
+    return _fallback(user_query, context)
+
+def _stream_slot(timeout: float):
+    """A slot of the shared LLM concurrency limit for a streamed answer (LLM_ASYNC)."""
+    if not LLM_ASYNC:
+        return nullcontext()
+    from backend import llm_async
+    return llm_async.slot(timeout)
+
+def call_llm_stream(user_query: str, context: str = "", chat_history: list = None, system_override: str = None,
+                    timeout: float = None):
+    """call_llm() as an iterator of text pieces, so the first tokens can be shown while the
+    rest is generated. The latency budget is taken when this is called and bounds the wait
+    for the first token; an answer that has started streaming is allowed to finish.
+    Falls back like call_llm() if the backend fails before any output."""
+    messages = _messages(user_query, context, chat_history, system_override)
+    t = _budget(timeout) if LLM_BACKEND == "groq" and GROQ_API_KEY else None
+    return _stream(user_query, context, messages, t)
+
+def _stream(user_query: str, context: str, messages: list, t: float):
+    if t is not None:
+        end = time.monotonic() + t
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(_stream_slot(t))
+            except (LLMBusy, concurrent.futures.TimeoutError) as e:   # local overload, not a provider failure
+                print(f"LLM busy: {str(e) or 'no LLM slot free within the latency budget'}")
+            else:
+                sent = ok = False
+                try:
+                    for piece in _stream_groq(messages, timeout=max(MIN_CALL_TIME, end - time.monotonic())):
+                        sent = True
+                        yield piece
+                    ok = sent
+                except Exception as e:
+                    print(f"LLM stream error: {e}")
+                    if sent:
+                        yield STREAM_CUT
+                _record(ok)
+                if sent:
+                    return
+    yield _fallback(user_query, context)
+
+MOCK_MARK = "🤖 **[Mock Response]**"
+DEGRADED_MARK = "⚠️ **The AI assistant is not responding right now**"
+STREAM_CUT = "\n\n_…response interrupted_"
+
+def _fallback(user_query: str, context: str = "") -> str:
+    """Non-LLM answer: the retrieved knowledge-base passages when there are any, else _mock."""
+    passages = re.findall(r"\[(\d+)\] Source: (.*)\n([\s\S]*?)(?=\n\n\[\d+\] Source: |\n=== END ===|\Z)", context or "")
+    if not passages:
+        return _mock(user_query)
+    lines = [f"{DEGRADED_MARK} — here is what the knowledge base says:\n"]
+    for n, src, text in passages:
+        text = text.strip()
+        if text == rag_pack.OMITTED:
+            lines.append(f"**[{n}] {src}**\n")
+            continue
+        if len(text) > 500:
+            text = text[:500].rsplit(" ", 1)[0] + " …"
+        lines.append(f"**[{n}] {src}**\n> " + text.replace("\n", "\n> ") + "\n")
+    return "\n".join(lines)
 
 def _mock(q):
-    return (f"🤖 **[Mock Response]** I received: *\"{q[:80]}\"*\n\n"
+    return (f"{MOCK_MARK} I received: *\"{q[:80]}\"*\n\n"
             "Install `groq` package and add `GROQ_API_KEY` to `.env` for real AI-powered answers.\n"
             "Get a free key at https://console.groq.com")
 
+def cacheable(answer: str) -> bool:
+    """False for empty answers, fallbacks and streams cut off by an error."""
+    return (bool(answer) and not answer.startswith((MOCK_MARK, DEGRADED_MARK))
+            and not answer.endswith(STREAM_CUT))
+
 def generate_sql(schema: str, request: str) -> str:
     """Generate SQL — tries LLM first, falls back to smart templates."""
     sys_p = "You are a SQL expert. Generate ONLY clean T-SQL with inline comments. No explanation outside code."
     msgs = [{"role":"system","content":sys_p},
             {"role":"user","content":f"Schema:\n{schema}\n\nGenerate SQL for: {request}"}]
     if LLM_BACKEND == "groq" and GROQ_API_KEY:
-        result = _call_groq(msgs, temperature=0.1, max_tokens=600)
+        result = _complete(msgs, temperature=0.1, max_tokens=600, cache=LLM_CACHE_SQL)
         if result:
             return result
     return _smart_sql(request, schema)
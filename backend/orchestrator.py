@@ -2,16 +2,28 @@
 import os, sys, re
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
+from config.settings import LLM_EXTRACT_TIMEOUT, LLM_CACHE_JIRA_EXTRACT, LLM_CACHE_HELPDESK_EXTRACT, CHAT_LATENCY_BUDGET
 from backend.intent_router import route, LABELS
 from backend import llm_handler as llm
 from backend import rag_handler as rag
+from backend import answer_cache
 
 def _db():
     from backend import jira_handler, hr_handler, data_handler
     return jira_handler, hr_handler, data_handler
 
-def process(query: str, chat_history: list = None, user_context: dict = None) -> dict:
+def process(query: str, chat_history: list = None, user_context: dict = None, stream: bool = False,
+            budget: float = None) -> dict:
+    """Route and answer `query`. With `stream`, free-text LLM answers come back as an iterator
+    of text pieces (llm.call_llm_stream) instead of a string; cached answers stay strings.
+    All LLM calls share a latency budget of `budget` (default CHAT_LATENCY_BUDGET) seconds;
+    once it is spent they are cancelled and the non-LLM fallbacks answer instead."""
+    with llm.deadline(CHAT_LATENCY_BUDGET if budget is None else budget):
+        return _process(query, chat_history, user_context, stream)
+
+def _process(query: str, chat_history: list, user_context: dict, stream: bool) -> dict:
     r   = route(query)
+    ask = llm.call_llm_stream if stream else llm.call_llm
     j, h, d = _db()
     intent = r.intent
     ex     = r.extracted
@@ -19,6 +31,7 @@ def process(query: str, chat_history: list = None, user_context: dict = None) ->
     ans    = ""
     data   = None
     rag_docs = []
+    cached = False
 
     # ── JIRA VIEW ─────────────────────────────────────────────────────────────
     if intent == "JIRA_VIEW":
@@ -57,7 +70,8 @@ description, priority (LOW/MEDIUM/HIGH/CRITICAL), assignee_name, story_points (n
 Request: "{query}"
 JSON:"""
         import json
-        raw = llm.call_llm(extract_prompt, system_override="Extract JSON only. No explanation.")
+        raw = llm.call_llm(extract_prompt, system_override="Extract JSON only. No explanation.",
+                           timeout=LLM_EXTRACT_TIMEOUT, cache=LLM_CACHE_JIRA_EXTRACT)
         try:
             clean = re.sub(r'```json|```','', raw).strip()
             fields = json.loads(clean)
@@ -102,11 +116,13 @@ JSON:"""
         rag_docs = rag.retrieve(query, source_filter=None)
         ctx = rag.format_context(rag_docs)
         if rag_docs:
-            ans = llm.call_llm(query, ctx, chat_history,
-                               system_override=f"You are an HR policy expert. Answer based ONLY on the provided policy documents. "
-                                               f"Quote exact policies with numbers/days when available. Be precise.")
+            ans, rag_docs, cached = answer_cache.answer(intent, query, rag_docs, lambda: ask(
+                query, ctx, chat_history,
+                system_override=f"You are an HR policy expert. Answer based ONLY on the provided policy documents. "
+                                f"Quote exact policies with numbers/days when available. Be precise."),
+                history=chat_history)
         else:
-            ans = llm.call_llm(query, "", chat_history)
+            ans = ask(query, "", chat_history)
 
     # ── HR LEAVE ──────────────────────────────────────────────────────────────
     elif intent == "HR_LEAVE":
@@ -114,11 +130,10 @@ JSON:"""
             # Extract leave details and guide user
             rag_docs = rag.retrieve("leave application policy rules", source_filter=None)
             ctx = rag.format_context(rag_docs)
-            ans = llm.call_llm(
-                f"Employee wants to apply for leave. Query: {query}\n"
-                "Explain the process, required fields, and any relevant policy rules. "
-                "Ask for missing info (leave type, dates) if not provided.",
-                ctx, chat_history)
+            ans = ask(f"Employee wants to apply for leave. Query: {query}\n"
+                      "Explain the process, required fields, and any relevant policy rules. "
+                      "Ask for missing info (leave type, dates) if not provided.",
+                      ctx, chat_history)
         elif any(w in q for w in ["balance","remaining","how many","available","left"]):
             # Show leave balance for current user or mentioned person
             person = ex.get("person","EMP002")
@@ -129,10 +144,10 @@ JSON:"""
                 ans  = _fmt_leave_balance(emp[0]["full_name"], balances)
             else:
                 rag_docs = rag.retrieve(query)
-                ans = llm.call_llm(query, rag.format_context(rag_docs), chat_history)
+                ans, rag_docs, cached = _rag_answer(query, rag_docs, chat_history, ask)
         else:
             rag_docs = rag.retrieve(query)
-            ans = llm.call_llm(query, rag.format_context(rag_docs), chat_history)
+            ans, rag_docs, cached = _rag_answer(query, rag_docs, chat_history, ask)
 
     # ── HR EMPLOYEE ───────────────────────────────────────────────────────────
     elif intent == "HR_EMPLOYEE":
@@ -152,7 +167,8 @@ JSON:"""
             # Extract ticket info with LLM
             ctx_prompt = f"Extract IT helpdesk ticket details from: '{query}'. Return a JSON with: title, description, category (Hardware/Software/Network/Access), priority (LOW/MEDIUM/HIGH/CRITICAL). JSON only."
             import json
-            raw = llm.call_llm(ctx_prompt, system_override="Return JSON only.")
+            raw = llm.call_llm(ctx_prompt, system_override="Return JSON only.", timeout=LLM_EXTRACT_TIMEOUT,
+                               cache=LLM_CACHE_HELPDESK_EXTRACT)
             try:
                 fields = json.loads(re.sub(r'```json|```','',raw).strip())
             except:
@@ -273,8 +289,7 @@ JSON:"""
     # ── GENERAL / AI ──────────────────────────────────────────────────────────
     else:
         rag_docs = rag.retrieve(query)
-        ctx = rag.format_context(rag_docs)
-        ans = llm.call_llm(query, ctx, chat_history)
+        ans, rag_docs, cached = _rag_answer(query, rag_docs, chat_history, ask)
 
     return {
         "intent":       intent,
@@ -284,8 +299,14 @@ JSON:"""
         "answer":       ans or "I couldn't process that request. Please try rephrasing.",
         "data":         data,
         "rag_docs":     rag_docs,
+        "cached":       cached,
     }
 
+def _rag_answer(query: str, rag_docs: list, chat_history: list, ask=llm.call_llm) -> tuple:
+    """Default-prompt LLM answer over the retrieved chunks, through the semantic answer cache."""
+    return answer_cache.answer("GENERAL", query, rag_docs,
+                               lambda: ask(query, rag.format_context(rag_docs), chat_history), history=chat_history)
+
 # ── Formatters ────────────────────────────────────────────────────────────────
 
 def _fmt_issue(i: dict) -> str:
@@ -0,0 +1,53 @@
+"""
+RAG ANN — IVF (inverted file) approximate nearest-neighbour index.
+A k-means coarse quantizer buckets the embedding rows; a query only scores
+the rows that live in its `nprobe` closest buckets (the recall/latency knob).
+"""
+import numpy as np
+
+def _normalize(m):
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-10)
+
+def _assign(matrix, centroids, block=65536):
+    out = np.empty(len(matrix), dtype=np.int32)
+    for s in range(0, len(matrix), block):
+        out[s:s+block] = np.argmax(_normalize(matrix[s:s+block]) @ centroids.T, axis=1)
+    return out
+
+def build(matrix, nlist: int = 0, iters: int = 10, seed: int = 42) -> dict:
+    """Train spherical k-means centroids and bucket every row of `matrix`."""
+    n = len(matrix)
+    nlist = min(nlist or max(1, int(np.sqrt(n))), n)
+    rng = np.random.default_rng(seed)
+    sample = _normalize(np.asarray(matrix[np.sort(rng.choice(n, min(n, nlist * 64), replace=False))],
+                                   dtype=np.float32))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iters):
+        a = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, a, sample)
+        counts = np.bincount(a, minlength=nlist)
+        filled = counts > 0
+        centroids[filled] = _normalize(sums[filled])
+    return _with_lists({"centroids": centroids, "assign": _assign(matrix, centroids)})
+
+def _with_lists(ivf: dict) -> dict:
+    a = ivf["assign"]
+    ivf["order"]   = np.argsort(a, kind="stable")
+    ivf["offsets"] = np.searchsorted(a[ivf["order"]], np.arange(len(ivf["centroids"]) + 1))
+    return ivf
+
+def candidates(ivf: dict, q, nprobe: int):
+    """Row indices in the `nprobe` buckets whose centroids are closest to `q`."""
+    cs = ivf["centroids"] @ _normalize(q)
+    nprobe = max(1, min(nprobe, len(cs)))
+    probe = np.argpartition(-cs, nprobe - 1)[:nprobe]
+    o, off = ivf["order"], ivf["offsets"]
+    return np.sort(np.concatenate([o[off[c]:off[c+1]] for c in probe]))
+
+def save(ivf: dict, path: str):
+    np.savez(path, centroids=ivf["centroids"], assign=ivf["assign"])
+
+def load(path: str) -> dict:
+    with np.load(path) as z:
+        return _with_lists({"centroids": z["centroids"], "assign": z["assign"]})
@@ -0,0 +1,66 @@
+"""
+RAG Artifact — precomputed embeddings for the built-in knowledge base, so a fresh
+container can seed its index without loading the embedding model.
+  <RAG_KB_ARTIFACT_DIR>/<embedder>.npy    unit-normalized float32, one row per KNOWLEDGE_DOCS entry
+  <RAG_KB_ARTIFACT_DIR>/<embedder>.json   {"format", "model", "docs_sha256", "count", "dim", "sha256"}
+The artifact is only used when the embedder name, the hash of the docs and the checksum
+of the .npy all match; otherwise seeding falls back to encoding.
+Build it (e.g. in the image build) with:  python -m backend.rag_artifact
+"""
+import os, sys, re, json, hashlib
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import RAG_KB_ARTIFACT_DIR
+
+FORMAT = 1
+DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", RAG_KB_ARTIFACT_DIR))
+
+def _paths(model: str):
+    base = os.path.join(DIR, re.sub(r"[^A-Za-z0-9_.-]+", "_", model))
+    return base + ".npy", base + ".json"
+
+def docs_hash(docs: list) -> str:
+    payload = [{"text": d["text"], "metadata": d["metadata"]} for d in docs]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def build(docs: list, model: str, embed_fn) -> str:
+    """Encode `docs` with `embed_fn` (normalized float32 rows) and write the artifact for `model`."""
+    npy, meta = _paths(model)
+    os.makedirs(DIR, exist_ok=True)
+    vecs = np.asarray(embed_fn([d["text"] for d in docs]), dtype=np.float32)
+    with open(npy + ".tmp", "wb") as f:
+        np.save(f, vecs)
+    os.replace(npy + ".tmp", npy)
+    with open(meta, "w") as f:
+        json.dump({"format": FORMAT, "model": model, "docs_sha256": docs_hash(docs),
+                   "count": len(docs), "dim": int(vecs.shape[1]), "sha256": _file_hash(npy)}, f, indent=1)
+    return npy
+
+def load(docs: list, model: str):
+    """Memory-mapped vectors for `docs` if a matching, intact artifact exists, else None."""
+    npy, meta = _paths(model)
+    if not (os.path.exists(npy) and os.path.exists(meta)):
+        return None
+    with open(meta) as f:
+        m = json.load(f)
+    if (m.get("format"), m.get("model"), m.get("docs_sha256"), m.get("count")) != \
+       (FORMAT, model, docs_hash(docs), len(docs)):
+        print(f"RAG: {os.path.basename(npy)} is stale for the current knowledge base, ignoring it")
+        return None
+    if _file_hash(npy) != m.get("sha256"):
+        print(f"RAG: {os.path.basename(npy)} failed its checksum, ignoring it")
+        return None
+    return np.load(npy, mmap_mode="r")
+
+if __name__ == "__main__":
+    from data.docs.knowledge_base import KNOWLEDGE_DOCS
+    from backend import rag_handler
+    name = rag_handler._get_embedder().name
+    print(f"Wrote {build(KNOWLEDGE_DOCS, name, rag_handler._embed)} ({len(KNOWLEDGE_DOCS)} docs, {name})")
@@ -0,0 +1,113 @@
+"""
+RAG Cache
+- persistent chunk-embedding cache in SQLite, keyed by (model name, sha256 of chunk text)
+  so re-uploads, rebuilds and re-seeding never encode an unchanged chunk twice
+- LRUCache: bounded in-memory LRU/TTL cache used for query vectors and retrieval results
+"""
+import os, sys, sqlite3, hashlib, threading, time
+from collections import OrderedDict
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import RAG_EMBED_CACHE_PATH
+
+DB = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", RAG_EMBED_CACHE_PATH))
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def _conn():
+    os.makedirs(os.path.dirname(DB), exist_ok=True)
+    conn = sqlite3.connect(DB, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+                 "model TEXT NOT NULL, hash TEXT NOT NULL, vec BLOB NOT NULL, PRIMARY KEY (model, hash))")
+    return conn
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_cached(texts: list, model: str, embed_fn):
+    """Vectors for `texts`, taking cached rows where possible and calling `embed_fn`
+    (a batch encoder returning float32 rows) once for the misses."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    hashes = [text_hash(t) for t in texts]
+    found = {}
+    conn = _conn()
+    try:
+        uniq = list(dict.fromkeys(hashes))
+        for s in range(0, len(uniq), 500):
+            part = uniq[s:s+500]
+            rows = conn.execute(f"SELECT hash, vec FROM chunk_embeddings WHERE model=? AND hash IN "
+                                f"({','.join('?' * len(part))})", [model, *part]).fetchall()
+            found.update((h, np.frombuffer(v, dtype=np.float32)) for h, v in rows)
+        miss = [h for h in uniq if h not in found]
+        if miss:
+            first = {h: i for i, h in reversed(list(enumerate(hashes)))}
+            vecs = np.asarray(embed_fn([texts[first[h]] for h in miss]), dtype=np.float32)
+            conn.executemany("INSERT OR REPLACE INTO chunk_embeddings (model, hash, vec) VALUES (?,?,?)",
+                             [(model, h, v.tobytes()) for h, v in zip(miss, vecs)])
+            conn.commit()
+            found.update(zip(miss, vecs))
+    finally:
+        conn.close()
+    with _stats_lock:
+        _stats["hits"] += len(texts) - len(miss)
+        _stats["misses"] += len(miss)
+    return np.stack([found[h] for h in hashes])
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    total = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / total, 3) if total else 0.0
+    return s
+
+def clear(model: str = None):
+    conn = _conn()
+    try:
+        if model: conn.execute("DELETE FROM chunk_embeddings WHERE model=?", (model,))
+        else:     conn.execute("DELETE FROM chunk_embeddings")
+        conn.commit()
+    finally:
+        conn.close()
+
+# ── In-memory LRU / TTL ───────────────────────────────────────────────────────
+
+class LRUCache:
+    """Thread-safe LRU cache with an optional per-entry TTL (seconds, 0 = no expiry)."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 0):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (not self.ttl or time.monotonic() - item[1] < self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
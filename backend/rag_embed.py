@@ -0,0 +1,85 @@
+"""
+RAG Embedders — pluggable text encoders behind one small interface:
+  name            identity written to the index manifest and the embedding cache, so
+                  vectors from two different encoders are never mixed
+  encode(texts)   float32 array (n, dim); rag_handler normalizes the rows
+Backends (EMBEDDING_BACKEND):
+  sentence-transformers   EMBEDDING_MODEL, imported and loaded on first encode
+  hashing                 pure NumPy, no model download: hashed word / bigram / char-trigram
+                          TF features, sparse random projection to EMBEDDING_DIM
+"""
+import os, sys, zlib, math
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import EMBEDDING_BACKEND, EMBEDDING_MODEL, EMBEDDING_DIM
+from backend import rag_sparse
+
+class SentenceTransformerEmbedder:
+    cache = True   # encoding is expensive: keep chunk vectors in rag_cache
+
+    def __init__(self, model: str):
+        self.name = model
+        self._model = None
+
+    def encode(self, texts: list):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.name)
+        return self._model.encode(texts, show_progress_bar=False)
+
+class HashingEmbedder:
+    """Feature hashing + sparse random projection. Each feature (word, word bigram,
+    character trigram) gets sublinear TF weight and is added with a hash-derived sign to
+    NNZ of the `dim` output components, so the projection matrix is never materialized.
+    Deterministic across processes and hosts (crc32, not Python's salted hash())."""
+    cache = False   # cheaper to recompute than to look up
+    NNZ = 8
+    WEIGHTS = {"w": 1.0, "b": 0.5, "c": 0.25}
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.name = f"hashing-v1-{dim}"
+
+    def _features(self, text: str) -> dict:
+        toks = rag_sparse.tokenize(text)
+        counts = {}
+        def add(f):
+            counts[f] = counts.get(f, 0) + 1
+        for t in toks:
+            add("w:" + t)
+            padded = f"<{t}>"
+            for i in range(len(padded) - 2):
+                add("c:" + padded[i:i+3])
+        for a, b in zip(toks, toks[1:]):
+            add(f"b:{a} {b}")
+        return {f: self.WEIGHTS[f[0]] * (1 + math.log(c)) for f, c in counts.items()}
+
+    def encode(self, texts: list):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, hashes, weights = [], [], []
+        for r, text in enumerate(texts):
+            feats = self._features(text)
+            rows.extend([r] * len(feats))
+            hashes.extend(zlib.crc32(f.encode("utf-8")) for f in feats)
+            weights.extend(feats.values())
+        if not rows:
+            return out
+        rows, weights = np.array(rows), np.array(weights, dtype=np.float32) / math.sqrt(self.NNZ)
+        h = np.array(hashes, dtype=np.uint64)
+        for j in range(self.NNZ):
+            x = (h + np.uint64(j + 1)) * np.uint64(0x9E3779B97F4A7C15)   # wraps mod 2**64
+            x ^= x >> np.uint64(29)
+            col = ((x >> np.uint64(32)) % np.uint64(self.dim)).astype(np.int64)
+            sign = np.where((x >> np.uint64(7)) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+            np.add.at(out, (rows, col), sign * weights)
+        return out
+
+BACKENDS = {
+    "sentence-transformers": lambda: SentenceTransformerEmbedder(EMBEDDING_MODEL),
+    "hashing":               lambda: HashingEmbedder(EMBEDDING_DIM),
+}
+
+def get(backend: str = EMBEDDING_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r} (one of: {', '.join(BACKENDS)})")
+    return BACKENDS[backend]()
@@ -1,71 +1,644 @@
 """
 RAG Handler — Pure Python (numpy + sentence-transformers)
 Handles both static knowledge docs AND dynamically uploaded HR PDFs.
+Vectors are unit-normalized at embed time, so similarity is a single dot product.
 """
-import os, sys, pickle
+import os, sys, json, heapq, pickle, sqlite3, hashlib, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import numpy as np
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-from config.settings import EMBEDDING_MODEL, RAG_TOP_K, RAG_INDEX_PATH, HR_PDF_DIR
+from config.settings import (
+    EMBEDDING_MODEL, RAG_TOP_K, RAG_INDEX_PATH, RAG_VECTOR_DTYPE, HR_PDF_DIR,
+    RAG_SEARCH_MODE, RAG_ANN_MIN_DOCS, RAG_IVF_NLIST, RAG_IVF_NPROBE,
+    RAG_MAX_SEGMENTS, RAG_COMPACT_TOMBSTONE_RATIO, RAG_EMBED_CACHE,
+    RAG_QUERY_CACHE_SIZE, RAG_RESULT_CACHE_SIZE, RAG_QUERY_CACHE_TTL,
+    RAG_HYBRID, RAG_RRF_K, RAG_HYBRID_MIN_MATCH, RAG_SPARSE_CANDIDATES, RAG_SPARSE_PREFILTER_MIN_DOCS,
+    RAG_INGEST_BATCH, RAG_INGEST_SEGMENT_ROWS, RAG_INGEST_WORKERS,
+    RAG_SHARED_INDEX, RAG_SYNC_INTERVAL, RAG_EMBED_WORKER, RAG_EMBED_WORKER_AUTOSTART, SQLITE_PATH,
+    RAG_SEARCH_SHARDS, RAG_SEARCH_SHARD_ROWS, RAG_VECTOR_QUANT, RAG_QUANT_RERANK, RAG_CONTEXT_TOKENS
+)
+from backend import rag_ann, rag_store, rag_cache, rag_sparse, rag_embed, rag_artifact, rag_quant, rag_pack, embed_worker
 
 _embedder = None
-_docs = []           # [{text, metadata, source}]
-_embeddings = None
+_worker_retry_at = 0.0   # monotonic time before which the embedding worker is not retried
+_search_pool = None      # threads scoring search shards, created on first sharded search
+_pool_lock = threading.Lock()
+# (version, live segments oldest first). Copy-on-write: replaced whole by _publish and never
+# mutated, and neither are the segment dicts in it ({name, docs, vecs, ann, sparse, codes,
+# parts, deleted}; codes is the int8 copy of vecs, or None)
+_snap = (0, ())
+_manifest = None     # rag_store manifest mirroring _snap
+_lock = threading.RLock()   # serialises writers (add / delete / compaction swap)
+_compact_lock = threading.Lock()   # one compaction at a time
+_compactor = None
+_stamp = None        # manifest_stamp() when this process last read or wrote the manifest
+_synced_at = 0.0
+_query_cache  = rag_cache.LRUCache(RAG_QUERY_CACHE_SIZE, RAG_QUERY_CACHE_TTL)
+_result_cache = rag_cache.LRUCache(RAG_RESULT_CACHE_SIZE, RAG_QUERY_CACHE_TTL)
 _ready = False
 INDEX_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", RAG_INDEX_PATH))
+if INDEX_PATH.endswith(".pkl"):
+    INDEX_PATH = INDEX_PATH[:-4]
+LEGACY_PICKLE = INDEX_PATH + ".pkl"   # pre-2.1 format, migrated on first load
+PDF_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", HR_PDF_DIR))
+APP_DB  = os.path.normpath(os.path.join(os.path.dirname(__file__), "..", SQLITE_PATH))
+DOC_TYPES = (".pdf", ".txt", ".docx")
+REBUILD_ATTEMPTS = 3   # diff-build-commit rounds before rebuild() does it all under the lock
 
 def _get_embedder():
+    """The configured rag_embed backend (EMBEDDING_BACKEND); models load on first encode."""
     global _embedder
     if _embedder is None:
-        from sentence_transformers import SentenceTransformer
-        _embedder = SentenceTransformer(EMBEDDING_MODEL)
+        _embedder = rag_embed.get()
     return _embedder
 
+def _normalize(m):
+    m = np.asarray(m, dtype=np.float32)
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-10)
+
+def _encode(texts):
+    """Raw encoder output: sentence-transformers models go through the shared embedding
+    worker when RAG_EMBED_WORKER is set and reachable (starting it if allowed); everything
+    else is encoded in this process."""
+    global _worker_retry_at
+    embedder = _get_embedder()
+    if RAG_EMBED_WORKER and isinstance(embedder, rag_embed.SentenceTransformerEmbedder) \
+            and time.monotonic() >= _worker_retry_at:
+        try:
+            return embed_worker.embed(texts)
+        except (OSError, EOFError, RuntimeError) as e:
+            if RAG_EMBED_WORKER_AUTOSTART and not isinstance(e, RuntimeError) and embed_worker.start():
+                try:
+                    return embed_worker.embed(texts)
+                except (OSError, EOFError, RuntimeError) as e2:
+                    e = e2
+            print(f"RAG: embedding worker unavailable ({e}), encoding in-process for 60s")
+            _worker_retry_at = time.monotonic() + 60
+    return embedder.encode(texts)
+
 def _embed(texts):
-    return np.array(_get_embedder().encode(texts, show_progress_bar=False), dtype=np.float32)
+    """Unit-normalized float32 vectors, one row per text."""
+    return _normalize(_encode(texts))
 
-def _cosine_sim(q, matrix):
-    q = q / (np.linalg.norm(q) + 1e-10)
-    m = matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
-    return m @ q
+def _embed_chunks(texts):
+    """Like _embed, but served from the persistent content-hash cache when enabled."""
+    if not RAG_EMBED_CACHE or not _get_embedder().cache:
+        return _embed(texts)
+    return rag_cache.embed_cached(texts, _get_embedder().name, _embed)
 
-def _save():
-    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
-    with open(INDEX_PATH, "wb") as f:
-        pickle.dump({"docs": _docs, "embeddings": _embeddings}, f)
+def embed_cache_stats() -> dict:
+    """Chunk-embedding cache hits/misses since process start."""
+    return rag_cache.stats()
 
-def _load():
-    global _docs, _embeddings
-    if not os.path.exists(INDEX_PATH):
+def _query_key(query: str) -> str:
+    return " ".join(query.lower().split())
+
+def _publish(segs, bump: bool = True):
+    """Swap in a new snapshot in one assignment. Readers grab `_snap` once per call and keep
+    using that tuple, so they never wait on a writer or see a half-applied write. The version
+    (bumped unless the rows' contents are unchanged) keys the retrieval-result cache."""
+    global _snap
+    _snap = (_snap[0] + bump, tuple(segs))
+
+def index_version() -> int:
+    """Bumped on every write that changes what a query can retrieve."""
+    return _snap[0]
+
+def query_vector(query: str):
+    """Unit-normalized vector of `query`, shared with retrieve() through the query cache."""
+    return _embed_queries([query])[0]
+
+def query_cache_stats() -> dict:
+    return {"vectors": _query_cache.stats(), "results": _result_cache.stats(), "index_version": _snap[0]}
+
+def _to_store(vecs):
+    return np.asarray(vecs, dtype=RAG_VECTOR_DTYPE)
+
+def _cosine_sim(q, matrix, block=65536):
+    """Scores of every row against q: shape (rows,) for one query, (rows, queries) for a batch.
+    Both sides are unit-normalized already, so cosine similarity is the dot product.
+    float16 stores are widened block by block to keep BLAS on the float32 path."""
+    if matrix.dtype == np.float32:
+        return matrix @ q.T
+    if not len(matrix):
+        return np.zeros((0,) + q.shape[:-1], dtype=np.float32)
+    return np.concatenate([np.asarray(matrix[s:s+block], dtype=np.float32) @ q.T
+                           for s in range(0, len(matrix), block)])
+
+# ── Segments ──────────────────────────────────────────────────────────────────
+
+def _ann_wanted(n: int) -> bool:
+    if RAG_SEARCH_MODE == "ivf":
+        return n > 0
+    if RAG_SEARCH_MODE == "exact":
         return False
+    return n >= RAG_ANN_MIN_DOCS
+
+def _open_segment(name: str, manifest: dict = None) -> dict:
+    docs, vecs, ann, sparse = rag_store.read_segment(INDEX_PATH, name)
+    deleted = np.zeros(len(docs), dtype=bool)
+    deleted[(manifest or _manifest)["tombstones"].get(name, [])] = True
+    if ann is None and _ann_wanted(len(docs)):
+        ann = rag_ann.build(vecs, RAG_IVF_NLIST)
+        rag_store.write_segment_ann(INDEX_PATH, name, ann)
+    if sparse is None:
+        sparse = rag_sparse.build([d["text"] for d in docs])
+        rag_store.write_segment_sparse(INDEX_PATH, name, sparse)
+    codes = None
+    if RAG_VECTOR_QUANT == "int8":
+        codes = rag_store.read_segment_codes(INDEX_PATH, name)
+        if codes is None:
+            rag_store.write_segment_codes(INDEX_PATH, name, rag_quant.quantize(vecs))
+            codes = rag_store.read_segment_codes(INDEX_PATH, name)
+    return {"name": name, "docs": docs, "vecs": vecs, "ann": ann, "sparse": sparse, "codes": codes,
+            "parts": _partitions(docs), "deleted": deleted}
+
+def _partition_key(d: dict):
+    m = d["metadata"]
+    return (str(m.get("type", "")), str(m.get("source", "internal")))
+
+def _runs(values: list) -> dict:
+    """{value: [(start, end), ...]} for each run of equal consecutive values."""
+    runs, start = {}, 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            runs.setdefault(values[start], []).append((start, i))
+            start = i
+    return runs
+
+def _partitions(docs: list) -> dict:
+    """Row ranges per metadata type and per source. Segments are written sorted by
+    (type, source), so each partition is one contiguous slice of the memmapped matrix."""
+    return {"type":   _runs([d["metadata"].get("type") for d in docs]),
+            "source": _runs([d["metadata"].get("source", "internal") for d in docs])}
+
+def _write_segment(name: str, docs: list, vecs):
+    """Sort rows by partition, build the IVF and inverted indexes and write the segment
+    (not yet committed). Returns (segment, order) where new row i was input row order[i]."""
+    order = sorted(range(len(docs)), key=lambda i: _partition_key(docs[i]))
+    docs = [docs[i] for i in order]
+    vecs = _to_store(np.asarray(vecs)[order])
+    ann = rag_ann.build(vecs, RAG_IVF_NLIST) if _ann_wanted(len(docs)) else None
+    sparse = rag_sparse.build([d["text"] for d in docs])
+    rag_store.write_segment(INDEX_PATH, name, docs, vecs, ann, sparse, dtype=RAG_VECTOR_DTYPE)
+    codes = None
+    if RAG_VECTOR_QUANT == "int8":
+        rag_store.write_segment_codes(INDEX_PATH, name, rag_quant.quantize(vecs))
+        codes = rag_store.read_segment_codes(INDEX_PATH, name)
+    # Serve from the file mapping rather than a private copy, like every other process does
+    seg = {"name": name, "docs": docs, "vecs": rag_store.open_vectors(INDEX_PATH, name), "codes": codes, "ann": ann, "sparse": sparse,
+           "parts": _partitions(docs), "deleted": np.zeros(len(docs), dtype=bool)}
+    return seg, np.array(order, dtype=np.int64)
+
+def _commit_manifest():
+    global _stamp
+    rag_store.write_manifest(INDEX_PATH, _manifest)
+    _stamp = rag_store.manifest_stamp(INDEX_PATH)
+
+def _sync(force: bool = False):
+    """Attach segments and tombstones other worker processes committed to the shared index
+    directory. Checks the manifest's stat at most every RAG_SYNC_INTERVAL seconds; segments
+    already open are kept, so a new upload only maps the new segment's files."""
+    global _manifest, _stamp, _synced_at
+    if not RAG_SHARED_INDEX or _manifest is None:
+        return
+    now = time.monotonic()
+    if not force and now - _synced_at < RAG_SYNC_INTERVAL:
+        return
+    _synced_at = now
+    stamp = rag_store.manifest_stamp(INDEX_PATH)
+    if stamp == _stamp:
+        return
+    with _lock:
+        m = rag_store.read_manifest(INDEX_PATH)
+        if m is None or (m.get("index_id"), m.get("generation")) == \
+                        (_manifest.get("index_id"), _manifest.get("generation")):
+            _stamp = stamp
+            return
+        # A different index_id means the index was rebuilt and segment names were reused
+        have = {s["name"]: s for s in _snap[1]} if m.get("index_id") == _manifest.get("index_id") else {}
+        segs = []
+        for name in m["segments"]:
+            try:
+                seg = have.get(name) or _open_segment(name, m)
+            except (OSError, ValueError) as e:
+                # Compacted away between our manifest read and now; retry on the next check
+                print(f"RAG sync deferred: {e}")
+                return
+            deleted = np.zeros(len(seg["docs"]), dtype=bool)
+            deleted[m["tombstones"].get(name, [])] = True
+            if not np.array_equal(deleted, seg["deleted"]):
+                seg = dict(seg, deleted=deleted)
+            segs.append(seg)
+        _manifest, _stamp = m, stamp
+        _publish(segs)
+
+@contextmanager
+def _writer():
+    """Held while changing the manifest: serialises this process's threads (_lock) and all
+    processes sharing INDEX_PATH (file lock), and starts from the latest committed state."""
+    with _lock, rag_store.locked(INDEX_PATH):
+        _sync(force=True)
+        yield
+
+def _source_rows(names):
+    """select() for _drop_rows: every row whose metadata source is one of `names`."""
+    names = set(names)
+    return lambda seg: [i for s in names for b, e in seg["parts"]["source"].get(s, []) for i in range(b, e)]
+
+def _record_sources(record: dict):
+    """Apply {source: entry or None} to the manifest's source-hash records (caller holds _writer)."""
+    sources = _manifest.setdefault("sources", {})
+    for k, v in (record or {}).items():
+        if v is None: sources.pop(k, None)
+        else:         sources[k] = v
+
+def _append_segments(batches: list, drop=(), record: dict = None) -> list:
+    """Write each (docs, vecs) pair as a new immutable segment, then commit them in one step
+    together with tombstones for every row of the `drop` sources and the `record` updates to
+    the source-hash records, so readers see either the old state or all of the new one."""
+    names = []
+    if batches:
+        with _writer():
+            names = [rag_store.next_segment_name(_manifest) for _ in batches]
+            _commit_manifest()   # reserve the names for other processes
+    segs = [_write_segment(name, docs, vecs)[0] for name, (docs, vecs) in zip(names, batches)]
+    with _writer():
+        old = _drop_rows(_source_rows(drop))[0] if drop else list(_snap[1])
+        _manifest["segments"].extend(names)
+        _record_sources(record)
+        _commit_manifest()
+        _publish(old + segs)
+    _schedule_compaction()
+    return segs
+
+def _append_segment(docs: list, vecs) -> dict:
+    """Write `docs`/`vecs` as a new immutable segment and commit it to the manifest."""
+    return _append_segments([(docs, vecs)])[0]
+
+def _drop_rows(select):
+    """Copies of the snapshot's segments with the live rows `select(seg)` returns (row
+    indices) tombstoned in them and in the manifest. Caller holds _writer() and commits.
+    Returns (segments, rows dropped)."""
+    n, segs = 0, []
+    for seg in _snap[1]:
+        rows = [i for i in select(seg) if not seg["deleted"][i]]
+        if rows:
+            deleted = seg["deleted"].copy()
+            deleted[rows] = True
+            seg = dict(seg, deleted=deleted)
+            _manifest["tombstones"][seg["name"]] = np.flatnonzero(deleted).tolist()
+            n += len(rows)
+        segs.append(seg)
+    return segs, n
+
+def _tombstone(select, forget=()) -> int:
+    """Mark the live rows `select(seg)` returns as deleted and drop the `forget` sources'
+    hash records. Returns rows deleted."""
+    with _writer():
+        segs, n = _drop_rows(select)
+        if n or forget:
+            _record_sources({s: None for s in forget})
+            _commit_manifest()
+            _publish(segs)
+    if n:
+        _schedule_compaction()
+    return n
+
+def _live_rows(seg) -> int:
+    return len(seg["docs"]) - int(seg["deleted"].sum())
+
+def _pick_compaction(segs: list) -> list:
+    """Tiered policy: merge the smallest segments once there are more than RAG_MAX_SEGMENTS,
+    and rewrite any segment whose tombstoned fraction reached RAG_COMPACT_TOMBSTONE_RATIO."""
+    pick = []
+    if len(segs) > RAG_MAX_SEGMENTS:
+        pick = sorted(segs, key=_live_rows)[:len(segs) - RAG_MAX_SEGMENTS + 1]
+    for seg in segs:
+        if seg not in pick and len(seg["docs"]) and \
+           seg["deleted"].sum() / len(seg["docs"]) >= RAG_COMPACT_TOMBSTONE_RATIO:
+            pick.append(seg)
+    return pick
+
+def compact() -> int:
+    """Merge segments picked by the compaction policy into one. Returns segments merged.
+    The merged segment is written outside the lock; only the manifest swap blocks writers."""
+    with _compact_lock:
+        return _compact()
+
+def _compact() -> int:
+    with _writer():
+        pick = _pick_compaction(_snap[1])
+        if not pick:
+            return 0
+        names = [s["name"] for s in pick]
+        before = {s["name"]: s["deleted"] for s in pick}
+        name = rag_store.next_segment_name(_manifest)
+        _commit_manifest()
+    live = {n: np.flatnonzero(~before[n]) for n in names}
+    docs = [seg["docs"][i] for seg in pick for i in live[seg["name"]]]
+    parts = [np.asarray(seg["vecs"][live[seg["name"]]]) for seg in pick if len(live[seg["name"]])]
+    merged = None
+    if docs:
+        merged, order = _write_segment(name, docs, np.concatenate(parts))
+        new_row = np.argsort(order)   # input position -> row in the merged segment
+    with _writer():
+        if not set(names) <= set(_manifest["segments"]):
+            # Another process compacted (or the index was reset) while we were merging
+            rag_store.remove_segment(INDEX_PATH, name)
+            return 0
+        # Carry over tombstones that landed on the merged segments while we were writing
+        current = {s["name"]: s for s in _snap[1]}
+        offset = 0
+        for n in names:
+            late = np.flatnonzero(current[n]["deleted"] & ~before[n])
+            if merged is not None and len(late):
+                merged["deleted"][new_row[offset + np.searchsorted(live[n], late)]] = True
+            offset += len(live[n])
+            _manifest["tombstones"].pop(n, None)
+        _manifest["segments"] = [n for n in _manifest["segments"] if n not in names]
+        segs = [s for s in _snap[1] if s["name"] not in names]
+        if merged is not None:
+            _manifest["segments"].insert(0, name)
+            segs.insert(0, merged)
+            if merged["deleted"].any():
+                _manifest["tombstones"][name] = np.flatnonzero(merged["deleted"]).tolist()
+        _commit_manifest()
+        _publish(segs, bump=False)   # same live rows, so cached results stay valid
+    for n in names:
+        rag_store.remove_segment(INDEX_PATH, n)
+    print(f"RAG: Compacted {len(names)} segments into {name if merged is not None else 'nothing'}")
+    return len(names)
+
+def _compact_loop():
+    global _compactor
     try:
-        with open(INDEX_PATH, "rb") as f:
-            d = pickle.load(f)
-        _docs = d["docs"]; _embeddings = d["embeddings"]
-        return len(_docs) > 0
-    except:
+        while compact():
+            pass
+    except Exception as e:
+        print(f"RAG compaction error: {e}")
+    finally:
+        _compactor = None
+
+def _schedule_compaction():
+    """Run compaction on a background thread if the policy has work and none is running."""
+    global _compactor
+    with _lock:
+        if _compactor is not None or not _pick_compaction(_snap[1]):
+            return
+        _compactor = threading.Thread(target=_compact_loop, name="rag-compaction", daemon=True)
+        _compactor.start()
+
+def _load_legacy():
+    """Read the old {"docs", "embeddings"} pickle and rewrite it as the first segment."""
+    with open(LEGACY_PICKLE, "rb") as f:
+        d = pickle.load(f)
+    vecs = d["embeddings"] if _get_embedder().name == EMBEDDING_MODEL else \
+        _embed_chunks([doc["text"] for doc in d["docs"]])   # pickles were always sentence-transformers
+    _append_segment(d["docs"], _normalize(vecs))
+    print(f"RAG: Migrated {len(d['docs'])} docs from {os.path.basename(LEGACY_PICKLE)}")
+
+def _built_by_other(manifest: dict) -> bool:
+    return manifest is not None and manifest.get("model", "") not in ("", _get_embedder().name)
+
+def _reembed(old: dict):
+    """The index was built by a different embedder: re-encode its live chunks with the current
+    one into fresh segments and swap them in with one manifest write (caller holds the lock)."""
+    docs = []
+    for name in old["segments"]:
+        dead = set(old["tombstones"].get(name, []))
+        docs += [d for i, d in enumerate(rag_store.read_segment(INDEX_PATH, name)[0]) if i not in dead]
+    print(f"RAG: Index was built by {old['model']!r}; re-embedding {len(docs)} chunks with {_get_embedder().name!r}")
+    manifest = rag_store.new_manifest(_get_embedder().name, RAG_VECTOR_DTYPE)
+    manifest["next_id"] = old["next_id"]   # keep clear of the old segment names
+    manifest["sources"] = old.get("sources", {})
+    for b in range(0, len(docs), RAG_INGEST_SEGMENT_ROWS):
+        part = docs[b:b+RAG_INGEST_SEGMENT_ROWS]
+        name = rag_store.next_segment_name(manifest)
+        _write_segment(name, part, _embed_chunks([d["text"] for d in part]))
+        manifest["segments"].append(name)
+    rag_store.write_manifest(INDEX_PATH, manifest)
+    for name in old["segments"]:
+        rag_store.remove_segment(INDEX_PATH, name)
+    return manifest
+
+def _load():
+    global _manifest, _stamp
+    try:
+        rag_store.migrate_flat(INDEX_PATH)
+        _stamp = rag_store.manifest_stamp(INDEX_PATH)
+        _manifest = rag_store.read_manifest(INDEX_PATH)
+        if _built_by_other(_manifest):
+            with rag_store.locked(INDEX_PATH):
+                _manifest = rag_store.read_manifest(INDEX_PATH)   # another worker may have done it
+                if _built_by_other(_manifest):
+                    _manifest = _reembed(_manifest)
+                _stamp = rag_store.manifest_stamp(INDEX_PATH)
+        if _manifest is not None:
+            _publish([_open_segment(n) for n in _manifest["segments"]])
+        else:
+            _manifest = rag_store.new_manifest(_get_embedder().name, RAG_VECTOR_DTYPE)
+            _publish(())
+            if not os.path.exists(LEGACY_PICKLE):
+                return False
+            _load_legacy()
+        return _doc_count() > 0
+    except Exception as e:
+        print(f"RAG load warning: {e}")
+        _manifest = rag_store.new_manifest(_get_embedder().name, RAG_VECTOR_DTYPE)
+        _publish(())
         return False
 
-def _seed_base_docs():
-    global _docs, _embeddings
+def _doc_count() -> int:
+    return sum(_live_rows(s) for s in _snap[1])
+
+def quant_recall_report(queries: list = None, k: int = 10, n_queries: int = 200, seed: int = 0) -> dict:
+    """Recall@k of int8 search (codes + float re-rank) against exact float search over the
+    same segments. Uses `queries` (texts) if given, else stored chunk vectors with noise."""
+    init()
+    segs = [s for s in _snap[1] if s.get("codes") is not None]
+    if not segs:
+        return {"error": "no quantized segments (set RAG_VECTOR_QUANT=int8)"}
+    if queries:
+        Q = _embed(queries)
+    else:
+        rng = np.random.default_rng(seed)
+        picks = [(seg, int(i)) for seg in segs for i in np.flatnonzero(~seg["deleted"])]
+        picks = [picks[i] for i in rng.choice(len(picks), min(n_queries, len(picks)), replace=False)]
+        Q = np.stack([np.asarray(seg["vecs"][i], dtype=np.float32) for seg, i in picks])
+        Q = _normalize(Q + rng.normal(0, 0.5 / np.sqrt(Q.shape[1]), Q.shape).astype(np.float32))
+    plain = [dict(s, codes=None) for s in segs]
+    t0 = time.perf_counter()
+    approx = _search_shards(segs, Q, k, RAG_IVF_NPROBE, True)
+    t1 = time.perf_counter()
+    exact = _search_shards(plain, Q, k, RAG_IVF_NPROBE, True)
+    t2 = time.perf_counter()
+    hit = [len({(h[1]["name"], h[2]) for h in a} & {(h[1]["name"], h[2]) for h in e}) / max(1, len(e))
+           for a, e in zip(approx, exact)]
+    return {f"recall@{k}": round(float(np.mean(hit)), 4), "queries": len(Q), "rerank": RAG_QUANT_RERANK,
+            "int8_ms": round(1000 * (t1 - t0), 1), "float_ms": round(1000 * (t2 - t1), 1),
+            "int8_mb": round(sum(rag_quant.nbytes(s["codes"]) for s in segs) / 2**20, 2),
+            "float_mb": round(sum(s["vecs"].nbytes for s in segs) / 2**20, 2)}
+
+# ── Incremental rebuild ───────────────────────────────────────────────────────
+# manifest["sources"] = {source: {"origin": "kb" | "dir" | "upload", "hash", ...}} records the
+# content each indexed source was built from, committed together with its rows.
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _kb_sources() -> dict:
+    """Built-in KNOWLEDGE_DOCS grouped by metadata source: {source: (hash, docs, rows)}, where
+    rows are the docs' positions in KNOWLEDGE_DOCS (and in the precomputed artifact)."""
+    from data.docs.knowledge_base import KNOWLEDGE_DOCS
+    groups = {}
+    for i, d in enumerate(KNOWLEDGE_DOCS):
+        docs, rows = groups.setdefault(d["metadata"]["source"], ([], []))
+        docs.append({"text": d["text"], "metadata": d["metadata"]})
+        rows.append(i)
+    return {s: (_sha256(json.dumps(docs, sort_keys=True).encode("utf-8")), docs, rows)
+            for s, (docs, rows) in groups.items()}
+
+def _kb_vectors(rows: list):
+    """KB vectors for `rows`: from the precomputed artifact when it matches the current
+    embedder and docs (no model load), else encoded."""
     from data.docs.knowledge_base import KNOWLEDGE_DOCS
-    texts = [d["text"] for d in KNOWLEDGE_DOCS]
-    metas = [d["metadata"] for d in KNOWLEDGE_DOCS]
-    print(f"RAG: Indexing {len(texts)} base knowledge docs...")
-    vecs = _embed(texts)
-    _docs = [{"text": t, "metadata": m} for t, m in zip(texts, metas)]
-    _embeddings = vecs
-    _save()
-    print("RAG: Base docs indexed ✅")
+    pre = rag_artifact.load(KNOWLEDGE_DOCS, _get_embedder().name)
+    if pre is not None:
+        print(f"RAG: Seeding {len(rows)} base docs from the precomputed artifact")
+        return np.asarray(pre[rows])
+    return _embed_docs([KNOWLEDGE_DOCS[i] for i in rows])
+
+def _dir_files() -> dict:
+    """{filename: os.stat_result} for the documents in HR_PDF_DIR."""
+    if not os.path.isdir(PDF_DIR):
+        return {}
+    return {fn: os.stat(os.path.join(PDF_DIR, fn)) for fn in sorted(os.listdir(PDF_DIR))
+            if fn.lower().endswith(DOC_TYPES) and os.path.isfile(os.path.join(PDF_DIR, fn))}
+
+def _uploaded_documents():
+    """Filenames in the app's documents table, or None if it can't be read (keep all uploads)."""
+    try:
+        conn = sqlite3.connect(APP_DB)
+        try:
+            return {r[0] for r in conn.execute("SELECT filename FROM documents")}
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+def rebuild(progress=None) -> dict:
+    """Incremental rebuild: diff the current sources — KNOWLEDGE_DOCS, files in HR_PDF_DIR and
+    the documents table — against the content hashes stored in the index, re-chunk and
+    re-embed only added or modified sources and drop removed ones, in one commit.
+    Uploads are kept while their documents row exists (their bytes aren't stored).
+    The writer lock is held only to diff and to commit, not while parsing and embedding; if
+    another process changed the outcome of the diff meanwhile, the work is redone.
+    `progress` is called as in add_documents().
+    Returns {"added", "updated", "removed": [sources], "unchanged": count}."""
+    init()
+    for _ in range(REBUILD_ATTEMPTS):
+        with _writer():
+            plan = _plan()
+        built = _build(plan, progress)
+        with _writer():
+            fresh = _plan()
+            if fresh["key"] == plan["key"]:
+                return _commit(fresh, *built)
+        print("RAG rebuild: the index changed meanwhile, diffing again")
+    with _writer():   # still racing: do it all under the lock
+        return _rebuild(progress)
+
+def _rebuild(progress=None) -> dict:
+    """rebuild() in one go; the caller holds _writer()."""
+    plan = _plan()
+    return _commit(plan, *_build(plan, progress))
+
+def _plan() -> dict:
+    """Diff the current sources against the manifest (under _writer()). `key` identifies the
+    outcome, so a later diff can tell whether the work planned here is still what's needed."""
+    recorded = _manifest.get("sources", {})
+    live = {s for seg in _snap[1] for s, ranges in seg["parts"]["source"].items()
+            if any(not seg["deleted"][b:e].all() for b, e in ranges)}
+    changed, record, docs, kb_rows, files = [], {}, [], [], []
+    kb = _kb_sources()
+    for src, (h, kb_docs, rows) in kb.items():
+        if recorded.get(src, {}).get("hash") != h or src not in live:
+            changed.append(src)
+            record[src] = {"origin": "kb", "hash": h}
+            docs += kb_docs
+            kb_rows += rows
+    on_disk = _dir_files()
+    for fn, st in on_disk.items():
+        rec = recorded.get(fn, {})
+        stamp = {"size": st.st_size, "mtime": st.st_mtime_ns}
+        if fn in live and rec.get("origin") == "dir" and all(rec.get(k) == v for k, v in stamp.items()):
+            continue
+        with open(os.path.join(PDF_DIR, fn), "rb") as f:
+            data = f.read()
+        record[fn] = {"origin": "dir", "hash": _sha256(data), **stamp}
+        if fn in live and rec.get("hash") == record[fn]["hash"]:
+            continue   # touched, not modified: just refresh the stat
+        changed.append(fn)
+        files.append((data, fn))
+    uploads = _uploaded_documents()
+    current = {"kb": kb, "dir": on_disk, "upload": uploads}
+    removed = [s for s, rec in recorded.items() if s not in record
+               and current[rec["origin"]] is not None and s not in current[rec["origin"]]]
+    return {"key": json.dumps([changed, record, removed], sort_keys=True),
+            "live": live, "changed": changed, "record": record, "removed": removed,
+            "docs": docs, "kb_rows": kb_rows, "files": files}
+
+def _build(plan: dict, progress=None) -> tuple:
+    """Parse and embed what `plan` needs (no lock held). Returns (changed, record, docs, vecs)."""
+    changed, record, docs = list(plan["changed"]), dict(plan["record"]), list(plan["docs"])
+    # Files are parsed in the process pool; a file that fails keeps its previous rows
+    parsed = _parse_files(plan["files"], progress)
+    for _, fn in plan["files"]:
+        chunks, err = parsed[fn]
+        if err or not chunks:
+            print(f"RAG rebuild: skipping {fn} ({err or 'no text'})")
+            changed.remove(fn)
+            record.pop(fn)
+            continue
+        docs += _file_docs(fn, chunks, "HR Policy")
+    record.update({s: None for s in plan["removed"]})
+    vecs = None
+    if docs or record:
+        kb_rows = plan["kb_rows"]
+        vecs = _embed_docs(docs[len(kb_rows):], (lambda d, t, _n: progress(d, t, d, "chunks")) if progress else None)
+        if kb_rows:
+            vecs = np.concatenate([_kb_vectors(kb_rows), vecs]) if len(vecs) else _kb_vectors(kb_rows)
+    return changed, record, docs, vecs
+
+def _commit(plan: dict, changed: list, record: dict, docs: list, vecs) -> dict:
+    """Append the rebuilt rows and drop the old ones in one manifest write (under _writer())."""
+    live, removed = plan["live"], plan["removed"]
+    summary = {"added": [s for s in changed if s not in live], "updated": [s for s in changed if s in live],
+               "removed": removed, "unchanged": len(live - set(changed) - set(removed))}
+    if docs or record:
+        step = RAG_INGEST_SEGMENT_ROWS
+        _append_segments([(docs[b:b+step], vecs[b:b+step]) for b in range(0, len(docs), step)],
+                         drop=changed + removed, record=record)
+    print(f"RAG: Rebuild — {len(summary['added'])} added, {len(summary['updated'])} updated, "
+          f"{len(removed)} removed, {summary['unchanged']} unchanged (embedding cache: {rag_cache.stats()})")
+    return summary
 
 def init():
     global _ready
-    if _ready: return True
+    if _ready:
+        _sync()
+        return True
     try:
         if _load():
             _ready = True
-            print(f"RAG: Loaded {len(_docs)} docs from cache")
+            print(f"RAG: Loaded {_doc_count()} docs from {len(_snap[1])} segments")
         else:
-            _seed_base_docs()
+            with _writer():
+                # Several workers may start on an empty index; only the first one seeds it
+                if not _doc_count():
+                    _rebuild()
             _ready = True
         return True
     except Exception as e:
@@ -73,95 +646,475 @@ def init():
         _ready = False
         return False
 
-def add_pdf(file_bytes: bytes, filename: str, source_label: str = "HR Policy") -> int:
-    """Parse a PDF and add its chunks to the RAG index."""
-    global _docs, _embeddings, _ready
-    init()
-    try:
-        import io
+def _docx_text(file_bytes: bytes) -> str:
+    """Paragraph text of a .docx (word/document.xml), using only the standard library."""
+    import io, zipfile
+    from xml.etree import ElementTree
+    ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(io.BytesIO(file_bytes)) as z:
+        root = ElementTree.fromstring(z.read("word/document.xml"))
+    return "\n".join("".join(t.text or "" for t in p.iter(ns + "t")) for p in root.iter(ns + "p"))
+
+def _open_pages(file_bytes: bytes, filename: str = ""):
+    """(page_count, iterator of (page_no, text)). PDFs are extracted one page at a time;
+    .docx and anything else (or PDFs without pypdf) are a single text page."""
+    import io
+    ext = filename.lower().rsplit(".", 1)[-1] if "." in filename else "pdf"
+    if ext == "docx":
+        return 1, iter([(1, _docx_text(file_bytes))])
+    if ext == "pdf":
         try:
             import pypdf
             reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-            full_text = "\n".join(p.extract_text() or "" for p in reader.pages)
+            return len(reader.pages), ((n, p.extract_text() or "") for n, p in enumerate(reader.pages, 1))
         except ImportError:
-            # Fallback: treat as text
-            full_text = file_bytes.decode("utf-8", errors="ignore")
+            pass
+    # Fallback: treat as text
+    return 1, iter([(1, file_bytes.decode("utf-8", errors="ignore"))])
 
-        # Chunk into ~500 char overlapping segments
-        chunks = _chunk_text(full_text, chunk_size=600, overlap=100)
-        if not chunks:
-            return 0
+def _iter_chunks(pages, chunk_size=600, overlap=100):
+    """Streaming _chunk_text over (page_no, text) pairs: yields (chunk, first_page, last_page)
+    holding at most one window of words in memory. Produces the same chunks as _chunk_text
+    on the joined text."""
+    step = chunk_size - overlap
+    words, page_of = [], []
+
+    def emit():
+        chunk = " ".join(words[:chunk_size]).strip()
+        return (chunk, page_of[0], page_of[min(chunk_size, len(words)) - 1]) if len(chunk) > 50 else None
 
-        new_docs = [{"text": c, "metadata": {"type": "hr_policy", "source": filename, "label": source_label}}
-                    for c in chunks]
-        new_vecs = _embed([d["text"] for d in new_docs])
+    for page_no, text in pages:
+        for w in text.split():
+            words.append(w); page_of.append(page_no)
+            if len(words) > chunk_size:
+                # The window starting at words[0] is complete once a word beyond it arrives
+                c = emit()
+                if c: yield c
+                del words[:step], page_of[:step]
+    while words:
+        c = emit()
+        if c: yield c
+        del words[:step], page_of[:step]
 
-        _docs.extend(new_docs)
-        _embeddings = np.vstack([_embeddings, new_vecs]) if _embeddings is not None else new_vecs
-        _save()
-        print(f"RAG: Added {len(new_docs)} chunks from {filename}")
-        return len(new_docs)
+def _batched(it, n: int):
+    batch = []
+    for x in it:
+        batch.append(x)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def add_pdf(file_bytes: bytes, filename: str, source_label: str = "HR Policy", progress=None) -> int:
+    """Stream a PDF into the RAG index: extract page -> chunk -> embed in batches of
+    RAG_INGEST_BATCH -> append a segment every RAG_INGEST_SEGMENT_ROWS chunks, so memory
+    stays bounded by one batch. `progress(pages_done, total_pages, chunks)` is called as
+    pages are consumed. A failure part-way removes whatever this call already appended."""
+    init()
+    written = []
+    try:
+        total_pages, page_iter = _open_pages(file_bytes, filename)
+        pages_done = [0]
+        def pages():
+            for n, text in page_iter:
+                yield n, text
+                pages_done[0] = n
+        n_chunks, pend_docs, pend_vecs = 0, [], []
+        for batch in _batched(_iter_chunks(pages(), chunk_size=600, overlap=100), RAG_INGEST_BATCH):
+            docs = _file_docs(filename, batch, source_label)
+            pend_docs.extend(docs)
+            pend_vecs.append(_embed_chunks([d["text"] for d in docs]))
+            n_chunks += len(docs)
+            if len(pend_docs) >= RAG_INGEST_SEGMENT_ROWS:
+                written.append(_append_segment(pend_docs, np.concatenate(pend_vecs))["name"])
+                pend_docs, pend_vecs = [], []
+            if progress: progress(pages_done[0], total_pages, n_chunks)
+        # The last flush also records the file's content hash (see rebuild)
+        record = {filename: {"origin": "upload", "hash": _sha256(file_bytes)}} if n_chunks else None
+        written += [s["name"] for s in _append_segments(
+            [(pend_docs, np.concatenate(pend_vecs))] if pend_docs else [], record=record)]
+        if progress: progress(total_pages, total_pages, n_chunks)
+        print(f"RAG: Added {n_chunks} chunks from {filename} (embedding cache: {rag_cache.stats()})")
+        return n_chunks
     except Exception as e:
+        if written:
+            _tombstone(lambda seg: range(len(seg["docs"])) if seg["name"] in written else [])
         print(f"PDF add error: {e}")
         return 0
 
+def _parse_document(job):
+    """Process-pool worker: (file_bytes, filename) -> (filename, [(chunk, page, page_end)], error)."""
+    file_bytes, filename = job
+    try:
+        _, pages = _open_pages(file_bytes, filename)
+        return filename, list(_iter_chunks(pages, chunk_size=600, overlap=100)), None
+    except Exception as e:
+        return filename, [], str(e)
+
+def _file_docs(filename: str, chunks: list, source_label: str) -> list:
+    return [{"text": c, "metadata": {"type": "hr_policy", "source": filename, "label": source_label,
+                                     "page": p0, "page_end": p1}} for c, p0, p1 in chunks]
+
+def _parse_files(files: list, progress=None) -> dict:
+    """Parse and chunk [(file_bytes, filename), ...] in a process pool of RAG_INGEST_WORKERS.
+    Returns {filename: (chunks, error)}; `progress(files_done, total_files, chunks, "files")`."""
+    parsed = {}
+    def done(res):
+        parsed[res[0]] = res[1:]
+        if progress: progress(len(parsed), len(files), sum(len(r[0]) for r in parsed.values()), "files")
+    workers = min(RAG_INGEST_WORKERS, len(files))
+    try:
+        if workers <= 1:
+            raise RuntimeError("single worker")
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        # Spawned, not forked: forking this multithreaded process (LLM loop, search pool,
+        # compactor) can deadlock the child on a lock some other thread held
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            for fut in as_completed([pool.submit(_parse_document, f) for f in files]):
+                done(fut.result())
+    except Exception as e:
+        if workers > 1:
+            print(f"RAG: process pool unavailable ({e}), parsing in-process")
+        for f in files:
+            if f[1] not in parsed:
+                done(_parse_document(f))
+    return parsed
+
+def _embed_docs(docs: list, progress=None):
+    """Vectors for `docs` in batches of RAG_INGEST_BATCH; `progress(chunks_embedded, chunks, chunks_embedded)`."""
+    vecs = []
+    for b in range(0, len(docs), RAG_INGEST_BATCH):
+        vecs.append(_embed_chunks([d["text"] for d in docs[b:b+RAG_INGEST_BATCH]]))
+        if progress: progress(min(b + RAG_INGEST_BATCH, len(docs)), len(docs), min(b + RAG_INGEST_BATCH, len(docs)))
+    return np.concatenate(vecs) if vecs else np.zeros((0, 0), dtype=np.float32)
+
+def add_documents(files: list, source_label: str = "Uploaded Document", progress=None) -> dict:
+    """Bulk-ingest [(file_bytes, filename), ...] (PDF, TXT, DOCX). Files are parsed and
+    chunked in a process pool of RAG_INGEST_WORKERS, chunks from all files are embedded
+    together in batches, and every new segment is committed in one manifest write.
+    `progress(done, total, chunks, stage)` reports parsing as stage "files" (files parsed of
+    all files) and then embedding as stage "chunks" (chunks embedded of all chunks).
+    Returns {filename: chunks indexed} (0 for files that failed to parse)."""
+    init()
+    if not files:
+        return {}
+    parsed = _parse_files(files, progress)
+    docs, record = [], {}
+    for data, filename in files:
+        chunks, err = parsed[filename]
+        if err:
+            print(f"PDF add error ({filename}): {err}")
+        elif chunks:
+            record[filename] = {"origin": "upload", "hash": _sha256(data)}
+        docs += _file_docs(filename, chunks, source_label)
+    if not docs:
+        return {f[1]: 0 for f in files}
+    embedded = (lambda d, t, _n: progress(d, t, d, "chunks")) if progress else None
+    vecs = _embed_docs(docs, embedded)
+    step = RAG_INGEST_SEGMENT_ROWS
+    _append_segments([(docs[b:b+step], vecs[b:b+step]) for b in range(0, len(docs), step)], record=record)
+    counts = {f[1]: len(parsed[f[1]][0]) for f in files}
+    print(f"RAG: Added {len(docs)} chunks from {len(files)} files (embedding cache: {rag_cache.stats()})")
+    return counts
+
 def _chunk_text(text: str, chunk_size=600, overlap=100) -> list:
-    words = text.split()
-    chunks, i = [], 0
-    while i < len(words):
-        chunk = " ".join(words[i:i+chunk_size])
-        if len(chunk.strip()) > 50:
-            chunks.append(chunk.strip())
-        i += chunk_size - overlap
-    return chunks
-
-def retrieve(query: str, top_k: int = RAG_TOP_K, source_filter: str = None) -> list:
-    if not init() or _embeddings is None or not _docs:
+    return [c for c, _, _ in _iter_chunks([(1, text)], chunk_size, overlap)]
+
+def _top_rows(sims, k: int):
+    """Column-wise top-k row indices of a (rows, queries) score matrix, unordered."""
+    k = min(k, len(sims))
+    if k == 0:
+        return np.zeros((0, sims.shape[1]), dtype=np.int64)
+    return np.argpartition(-sims, k - 1, axis=0)[:k]
+
+def _intersect(a: list, b: list) -> list:
+    out, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        s, e = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if s < e:
+            out.append((s, e))
+        if a[i][1] < b[j][1]: i += 1
+        else: j += 1
+    return out
+
+def _filter_ranges(seg, doc_type: str = None, source: str = None):
+    """Row ranges of `seg` matching the metadata filters, or None when unfiltered."""
+    if not doc_type and not source:
+        return None
+    ranges = [(0, len(seg["docs"]))]
+    if doc_type:
+        ranges = _intersect(ranges, seg["parts"]["type"].get(doc_type, []))
+    if source:
+        ranges = _intersect(ranges, seg["parts"]["source"].get(source, []))
+    return ranges
+
+def _range_mask(n: int, ranges: list):
+    mask = np.zeros(n, dtype=bool)
+    for s, e in ranges:
+        mask[s:e] = True
+    return mask
+
+def _use_ann(seg, width: int, exact: bool) -> bool:
+    """IVF search for `width` rows of `seg`: whole segments, or filtered slices big enough."""
+    n = len(seg["docs"])
+    return seg["ann"] is not None and not exact and (width == n or width >= RAG_ANN_MIN_DOCS)
+
+def _search_segment(seg, Q, k: int, nprobe: int, exact: bool, ranges: list = None) -> list:
+    """Per query row of Q, [(sim, seg, row)] for the best `k` live rows of one segment,
+    restricted to `ranges` (partition slices) when given. Exact search scores the whole
+    batch with one matrix-matrix product over zero-copy slices of the memmap."""
+    n = len(seg["docs"])
+    ranges = [(0, n)] if ranges is None else ranges
+    width = sum(e - s for s, e in ranges)
+    if width == 0:
+        return [[] for _ in Q]
+    if _use_ann(seg, width, exact):
+        allowed = None if width == n else _range_mask(n, ranges)
+        out = []
+        for q in Q:
+            rows = rag_ann.candidates(seg["ann"], q, nprobe)
+            if allowed is not None:
+                rows = rows[allowed[rows]]
+            sims = np.where(seg["deleted"][rows], -np.inf, _cosine_sim(q, seg["vecs"][rows]))
+            top = _top_rows(sims[:, None], k)[:, 0]
+            out.append([(float(sims[t]), seg, int(rows[t])) for t in top if sims[t] > -np.inf])
+        return out
+    # int8 segments: scan the codes, then re-rank a RAG_QUANT_RERANK * k shortlist in float
+    quant = seg.get("codes") is not None
+    score = (lambda s, e: rag_quant.scores(seg["codes"], Q, s, e)) if quant else \
+            (lambda s, e: _cosine_sim(Q, seg["vecs"][s:e]))
+    if len(ranges) == 1:
+        (s, e), = ranges
+        sims, rows = score(s, e), None
+        sims[seg["deleted"][s:e]] = -np.inf
+    else:
+        sims = np.concatenate([score(s, e) for s, e in ranges])
+        sims[np.concatenate([seg["deleted"][s:e] for s, e in ranges])] = -np.inf
+        rows = np.concatenate([np.arange(s, e) for s, e in ranges])
+    top = _top_rows(sims, k * RAG_QUANT_RERANK if quant else k)
+    out = []
+    for j in range(len(Q)):
+        t = top[:, j][sims[top[:, j], j] > -np.inf]
+        r = rows[t] if rows is not None else t + ranges[0][0]
+        if quant:
+            r = np.sort(r)
+            exact_sims = _cosine_sim(Q[j], seg["vecs"][r])
+            best = _top_rows(exact_sims[:, None], k)[:, 0]
+            out.append([(float(exact_sims[b]), seg, int(r[b])) for b in best])
+        else:
+            out.append([(float(sims[tt, j]), seg, int(rr)) for tt, rr in zip(t, r)])
+    return out
+
+def _shards(segs: list, filters: dict = None, exact: bool = False) -> list:
+    """Split a search into (seg, ranges, exact) work units. IVF-searched segments stay whole;
+    rows that are scanned exactly are cut into about RAG_SEARCH_SHARDS pieces of at least
+    RAG_SEARCH_SHARD_ROWS rows, regardless of how they are spread over segments."""
+    units, scan = [], []
+    for seg in segs:
+        ranges = filters[seg["name"]] if filters else [(0, len(seg["docs"]))]
+        if _use_ann(seg, sum(e - s for s, e in ranges), exact):
+            units.append((seg, ranges, exact))
+        else:
+            scan.append((seg, ranges))
+    total = sum(e - s for _, ranges in scan for s, e in ranges)
+    size = max(RAG_SEARCH_SHARD_ROWS, -(-total // max(1, RAG_SEARCH_SHARDS)))
+    for seg, ranges in scan:
+        cur, width = [], 0
+        for s, e in ranges:
+            while s < e:
+                take = min(e - s, size - width)
+                cur.append((s, s + take))
+                width, s = width + take, s + take
+                if width == size:
+                    units.append((seg, cur, True))
+                    cur, width = [], 0
+        if cur:
+            units.append((seg, cur, True))
+    return units
+
+def _pool() -> ThreadPoolExecutor:
+    global _search_pool
+    with _pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=max(1, RAG_SEARCH_SHARDS), thread_name_prefix="rag-search")
+        return _search_pool
+
+def _search_shards(segs: list, Q, k: int, nprobe: int, exact: bool, filters: dict = None) -> list:
+    """Dense top-`k` per query row of Q over all `segs`: the shards from _shards are scored
+    concurrently on the search pool (NumPy releases the GIL in the matrix products and
+    partitions) and each query's per-shard top-k lists are merged with a heap."""
+    units = _shards(segs, filters, exact)
+    search = lambda u: _search_segment(u[0], Q, k, nprobe, u[2], u[1])
+    parts = list(_pool().map(search, units)) if len(units) > 1 and RAG_SEARCH_SHARDS > 1 else map(search, units)
+    merged = [[] for _ in Q]
+    for part in parts:
+        for j, hits in enumerate(part):
+            merged[j].extend(hits)
+    return [heapq.nlargest(k, hits, key=lambda h: h[0]) for hits in merged]
+
+def _sparse_search(segs: list, query: str, n: int, filters: dict = None) -> list:
+    """[(bm25, seg, row, strong)] for the best `n` live rows across segments, best first.
+    Collection statistics (doc count, avg length, df) are summed over all segments. `strong`
+    rows contain at least RAG_HYBRID_MIN_MATCH of the query's idf weight, so a query that
+    shares one common word with a chunk ("day", "time") is not a keyword match."""
+    terms = list(dict.fromkeys(rag_sparse.tokenize(query)))
+    segs = [s for s in segs if s.get("sparse") is not None]
+    if not terms or not segs:
+        return []
+    n_docs = sum(len(s["docs"]) for s in segs)
+    avgdl = sum(s["sparse"]["total_len"] for s in segs) / max(n_docs, 1)
+    idf = rag_sparse.idf(n_docs, {t: sum(rag_sparse.df(s["sparse"], t) for s in segs) for t in terms})
+    hits = []
+    for seg in segs:
+        ranges = (filters or {}).get(seg["name"])
+        if ranges is not None and not ranges:
+            continue
+        scores = rag_sparse.score(seg["sparse"], terms, idf, avgdl)
+        scores[seg["deleted"]] = 0
+        if ranges is not None:
+            scores[~_range_mask(len(scores), ranges)] = 0
+        rows = np.flatnonzero(scores > 0)
+        if len(rows) > n:
+            rows = rows[np.argpartition(-scores[rows], n - 1)[:n]]
+        strong = rag_sparse.coverage(seg["sparse"], terms, idf, rows) >= RAG_HYBRID_MIN_MATCH
+        hits.extend((float(scores[r]), seg, int(r), bool(m)) for r, m in zip(rows, strong))
+    hits.sort(key=lambda h: h[0], reverse=True)
+    return hits[:n]
+
+def _score_rows(q, hits: list) -> list:
+    """Dense [(sim, seg, row)] for the given (_, seg, row, ...) hits, in the same order."""
+    groups = {}
+    for i, (_, seg, row, *_) in enumerate(hits):
+        groups.setdefault(seg["name"], (seg, [], []))[1].append(row)
+        groups[seg["name"]][2].append(i)
+    sims = [0.0] * len(hits)
+    for seg, rows, pos in groups.values():
+        for p, v in zip(pos, _cosine_sim(q, seg["vecs"][np.array(rows)])):
+            sims[p] = float(v)
+    return [(sim, h[1], h[2]) for sim, h in zip(sims, hits)]
+
+def _fuse(dense: list, sparse: list, q) -> list:
+    """Reciprocal rank fusion of dense [(sim, seg, row)] and BM25 [(score, seg, row, strong)] hits.
+    Returns [(fused, sim, seg, row, keyword_hit)] best first (plain dense order without keyword
+    hits); keyword_hit marks strong BM25 matches, which _collect keeps past the dense cutoff."""
+    dense = sorted(dense, key=lambda h: h[0], reverse=True)
+    if not sparse:
+        return [(sim, sim, seg, row, False) for sim, seg, row in dense]
+    fused = {}
+    for r, (sim, seg, row) in enumerate(dense):
+        fused[(seg["name"], row)] = [1.0 / (RAG_RRF_K + r + 1), sim, seg, row, False]
+    for r, (_, seg, row, strong) in enumerate(sparse):
+        e = fused.setdefault((seg["name"], row), [0.0, None, seg, row, False])
+        e[0] += 1.0 / (RAG_RRF_K + r + 1)
+        e[4] = strong
+    missing = [e for e in fused.values() if e[1] is None]
+    for e, (sim, _, _) in zip(missing, _score_rows(q, [(0, e[2], e[3]) for e in missing])):
+        e[1] = sim
+    return sorted((tuple(e) for e in fused.values()), key=lambda h: h[0], reverse=True)
+
+def _collect(hits: list, top_k: int) -> list:
+    results = []
+    for _, sim, seg, row, keyword in hits:
+        dist = 1.0 - sim
+        if dist >= 0.85 and not keyword: continue
+        doc = seg["docs"][row]
+        results.append({"text": doc["text"], "metadata": doc["metadata"], "distance": round(dist, 3)})
+        if len(results) >= top_k:
+            break
+    return results
+
+def _embed_queries(queries: list):
+    """Query vectors from the LRU cache, encoding all misses in one batch."""
+    keys = [_query_key(q) for q in queries]
+    vecs = [_query_cache.get(k) for k in keys]
+    miss = list(dict.fromkeys(q for q, v in zip(queries, vecs) if v is None))
+    if miss:
+        fresh = dict(zip(miss, _embed(miss)))
+        for i, q in enumerate(queries):
+            if vecs[i] is None:
+                vecs[i] = fresh[q]
+                _query_cache.put(keys[i], vecs[i])
+    return np.stack(vecs)
+
+def retrieve_many(queries: list, top_k: int = RAG_TOP_K, source_filter: str = None, nprobe: int = None,
+                  exact: bool = False, source: str = None) -> list:
+    """retrieve() for a batch of queries: one encoder call for the uncached queries and one
+    matrix-matrix product per segment. Returns one result list per query, in order."""
+    if not queries:
         return []
+    if not init():
+        return [[] for _ in queries]
+    version, segs = _snap   # one consistent snapshot for the whole call; writers never block it
+    if not segs:
+        return [[] for _ in queries]
+    keys = [(version, _query_key(q), top_k, source_filter, source, nprobe, exact) for q in queries]
+    out = [_result_cache.get(k) for k in keys]
+    todo = [i for i, r in enumerate(out) if r is None]
     try:
-        q_vec = _embed([query])[0]
-        sims  = _cosine_sim(q_vec, _embeddings)
-        k = min(top_k, len(_docs))
-        top_idx = np.argsort(sims)[::-1][:k*2]
-        results = []
-        for idx in top_idx:
-            sim = float(sims[idx])
-            dist = 1.0 - sim
-            if dist >= 0.85: continue
-            doc = _docs[idx]
-            if source_filter and doc["metadata"].get("type") != source_filter:
-                continue
-            results.append({"text": doc["text"], "metadata": doc["metadata"], "distance": round(dist, 3)})
-            if len(results) >= top_k:
-                break
-        return results
+        if todo:
+            Q = _embed_queries([queries[i] for i in todo])
+            # Metadata filters select partition slices up front, so only matching rows are scored
+            filters = None
+            if source_filter or source:
+                filters = {seg["name"]: _filter_ranges(seg, source_filter, source) for seg in segs}
+                segs = [seg for seg in segs if filters[seg["name"]]]
+            rows = sum(len(s["docs"]) if filters is None else sum(e - b for b, e in filters[s["name"]])
+                       for s in segs) or 1
+            step = max(1, 2 ** 25 // rows)   # bound the (rows x queries) score matrix to ~128 MB
+            prefilter = RAG_HYBRID and 0 < RAG_SPARSE_PREFILTER_MIN_DOCS <= rows
+            for b in range(0, len(todo), step):
+                idx, Qb = todo[b:b+step], Q[b:b+step]
+                sparse = [_sparse_search(segs, queries[i], RAG_SPARSE_CANDIDATES, filters) if RAG_HYBRID else []
+                          for i in idx]
+                # Large corpora: when keywords matched, only the BM25 shortlist gets dense-scored
+                dense = [_score_rows(Qb[j], sparse[j]) if prefilter and sparse[j] else None
+                         for j in range(len(idx))]
+                full = [j for j, d in enumerate(dense) if d is None]
+                if full:
+                    hits = _search_shards(segs, Qb[full], top_k * 2, nprobe or RAG_IVF_NPROBE, exact, filters)
+                    for j, h in zip(full, hits):
+                        dense[j] = h
+                for j, i in enumerate(idx):
+                    out[i] = _collect(_fuse(dense[j], sparse[j], Qb[j]), top_k)
+                    _result_cache.put(keys[i], out[i])
+        return [[dict(r) for r in res] for res in out]
     except Exception as e:
         print(f"RAG retrieve error: {e}")
-        return []
+        return [[] for _ in queries]
+
+def retrieve(query: str, top_k: int = RAG_TOP_K, source_filter: str = None, nprobe: int = None,
+             exact: bool = False, source: str = None) -> list:
+    """Top-k chunks for `query` across all live segments. Dense hits are fused with BM25
+    keyword hits (RAG_HYBRID). `source_filter` (metadata type) and `source` (file name)
+    restrict the search to those partitions before scoring. Segments with an IVF index are
+    searched approximately unless `exact` is set; `nprobe` overrides RAG_IVF_NPROBE."""
+    return retrieve_many([query], top_k, source_filter, nprobe, exact, source)[0]
 
-def format_context(docs: list) -> str:
+def format_context(docs: list, budget: int = RAG_CONTEXT_TOKENS) -> str:
+    """Prompt context for the retrieved chunks: overlapping neighbours merged, near-duplicates
+    dropped and the rest fitted into `budget` estimated tokens (see rag_pack). Passages over
+    the budget are listed by citation only."""
     if not docs: return ""
     parts = ["=== CONTEXT FROM KNOWLEDGE BASE ==="]
-    for i, d in enumerate(docs, 1):
-        m = d["metadata"]
-        src = m.get("source") or m.get("table") or m.get("type","")
-        parts.append(f"\n[{i}] Source: {src}\n{d['text'].strip()}")
+    for i, p in enumerate(rag_pack.pack(docs, budget), 1):
+        src = "; ".join([rag_pack.cite(p["metadata"])] + p["also"])
+        parts.append(f"\n[{i}] Source: {src}\n{rag_pack.OMITTED if p['omitted'] else p['text'].strip()}")
     parts.append("=== END ===")
     return "\n".join(parts)
 
 def get_indexed_sources() -> list:
     init()
     sources = {}
-    for d in _docs:
-        s = d["metadata"].get("source", "internal")
-        sources[s] = sources.get(s, 0) + 1
+    for seg in _snap[1]:
+        for s, ranges in seg["parts"]["source"].items():
+            live = sum(e - b - int(seg["deleted"][b:e].sum()) for b, e in ranges)
+            if live:
+                sources[s] = sources.get(s, 0) + live
     return [{"source": k, "chunks": v} for k, v in sources.items()]
 
 def delete_source(filename: str) -> bool:
-    global _docs, _embeddings
-    before = len(_docs)
-    keep_idx = [i for i, d in enumerate(_docs) if d["metadata"].get("source") != filename]
-    _docs = [_docs[i] for i in keep_idx]
-    _embeddings = _embeddings[keep_idx] if _embeddings is not None and len(keep_idx) > 0 else None
-    _save()
-    return len(_docs) < before
+    """Tombstone every chunk from `filename`; compaction reclaims the space later."""
+    init()
+    return _tombstone(_source_rows([filename]), forget=[filename]) > 0
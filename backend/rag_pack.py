@@ -0,0 +1,104 @@
+"""
+RAG Pack — fit retrieved chunks into the prompt with as few tokens as possible.
+  merge    chunks of the same source whose words overlap (neighbouring windows of the
+           600/100-word chunker) are joined into one passage with the overlap written once
+  dedup    a chunk whose word 5-grams are mostly (RAG_CONTEXT_DEDUP) contained in a passage
+           already kept is dropped; its citation is kept on that passage
+  budget   passages are added in rank order until RAG_CONTEXT_TOKENS; the one that crosses
+           it is cut at a word boundary and the rest are kept as citations only (omitted).
+           Tokens are estimated as characters / 4.
+"""
+import os, sys, math
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from config.settings import RAG_CONTEXT_TOKENS, RAG_CONTEXT_DEDUP
+
+SHINGLE = 5
+MIN_OVERLAP = 8      # shared words needed to treat two chunks as neighbours
+MIN_TAIL = 50        # tokens worth adding as a truncated last passage
+OMITTED = "(not included: over the context budget)"
+
+def tokens(text: str) -> int:
+    return math.ceil(len(text) / 4)
+
+def _shingles(words: list) -> set:
+    low = [w.lower() for w in words]
+    return {tuple(low[i:i+SHINGLE]) for i in range(max(1, len(low) - SHINGLE + 1))}
+
+def _overlap(a: list, b: list) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 if under MIN_OVERLAP)."""
+    for m in range(min(len(a), len(b)) - 1, MIN_OVERLAP - 1, -1):
+        if a[-m:] == b[:m]:
+            return m
+    return 0
+
+def _source(m: dict) -> str:
+    return m.get("source") or m.get("table") or m.get("type", "")
+
+def cite(m: dict) -> str:
+    src = _source(m)
+    if m.get("page"):
+        src += f" (p. {m['page']}" + (f"-{m['page_end']}" if m.get("page_end", m["page"]) != m["page"] else "") + ")"
+    return src
+
+def _merge(a: dict, b: dict, m: int) -> dict:
+    """`b` continues `a` after `m` shared words."""
+    meta = dict(a["metadata"])
+    if meta.get("page") and b["metadata"].get("page"):
+        meta["page"] = min(meta["page"], b["metadata"]["page"])
+        meta["page_end"] = max(meta.get("page_end", meta["page"]),
+                               b["metadata"].get("page_end", b["metadata"]["page"]))
+    return {"words": a["words"] + b["words"][m:], "metadata": meta, "also": a["also"] + b["also"],
+            "rank": min(a["rank"], b["rank"])}
+
+def pack(docs: list, budget: int = RAG_CONTEXT_TOKENS, dedup: float = RAG_CONTEXT_DEDUP) -> list:
+    """Passages [{"text", "metadata", "also": [extra citations], "omitted"}] in rank order,
+    merged, de-duplicated and trimmed to `budget` tokens (0 = no limit). Passages that did not
+    fit come last with omitted=True and no text, so their citations are not lost."""
+    items = [{"words": d["text"].split(), "metadata": d["metadata"], "also": [], "rank": r}
+             for r, d in enumerate(docs)]
+    merged = True
+    while merged:
+        merged = False
+        for i, a in enumerate(items):
+            for j, b in enumerate(items):
+                if i == j or _source(a["metadata"]) != _source(b["metadata"]):
+                    continue
+                m = _overlap(a["words"], b["words"])
+                if m:
+                    items[i] = _merge(a, b, m)
+                    del items[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    items.sort(key=lambda it: it["rank"])
+    kept = []
+    for it in items:
+        sh = _shingles(it["words"])
+        dup = next((k for k in kept if dedup and len(sh & k["shingles"]) >= dedup * len(sh)), None)
+        if dup is not None:
+            c = cite(it["metadata"])
+            if c != cite(dup["metadata"]) and c not in dup["also"]:
+                dup["also"].append(c)
+            continue
+        it["shingles"] = sh
+        kept.append(it)
+    out, used, full = [], 0, False
+    for it in kept:
+        if full:
+            out.append({"text": "", "metadata": it["metadata"], "also": it["also"], "omitted": True})
+            continue
+        text = " ".join(it["words"])
+        n = tokens(text)
+        if budget and used + n > budget:
+            room = budget - used
+            if room < MIN_TAIL and out:
+                full = True
+                out.append({"text": "", "metadata": it["metadata"], "also": it["also"], "omitted": True})
+                continue
+            text = text[:room * 4 - 2].rsplit(" ", 1)[0] + " …"
+            n = tokens(text)
+        out.append({"text": text, "metadata": it["metadata"], "also": it["also"], "omitted": False})
+        used += n
+        full = bool(budget) and used >= budget - MIN_TAIL
+    return out
@@ -0,0 +1,90 @@
+"""
+RAG Sparse — per-segment inverted index and BM25 scoring.
+Built once when a segment is written (segments are immutable) and saved next to
+its vectors, so keyword search over exact terms ("gratuity", "LTA", "ACME-102")
+never has to re-tokenize the corpus.
+"""
+import re
+import numpy as np
+
+K1, B = 1.2, 0.75
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)*")
+_STOP = set("""a an and are as at be by can do does for from has have how i in is it its
+    my of on or our per should that the their this to was we what when where which who
+    will with you your""".split())
+
+def tokenize(text: str) -> list:
+    """Lower-cased word tokens; hyphenated terms (e.g. ticket keys) also yield their parts."""
+    out = []
+    for t in _TOKEN.findall(text.lower()):
+        if t in _STOP:
+            continue
+        out.append(t)
+        if "-" in t or "_" in t:
+            out.extend(p for p in re.split(r"[-_]", t) if p and p not in _STOP)
+    return out
+
+def build(texts: list) -> dict:
+    """CSR postings: terms[i]'s rows are rows[indptr[i]:indptr[i+1]] with term counts tfs[...]."""
+    postings, doclen = {}, np.zeros(len(texts), dtype=np.float32)
+    for row, text in enumerate(texts):
+        toks = tokenize(text)
+        doclen[row] = len(toks)
+        counts = {}
+        for t in toks:
+            counts[t] = counts.get(t, 0) + 1
+        for t, c in counts.items():
+            postings.setdefault(t, []).append((row, c))
+    terms = sorted(postings)
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(postings[t]) for t in terms])
+    flat = [p for t in terms for p in postings[t]]
+    return _with_vocab({
+        "terms": np.array(terms, dtype=str),
+        "indptr": indptr,
+        "rows": np.array([r for r, _ in flat], dtype=np.int32),
+        "tfs": np.array([c for _, c in flat], dtype=np.float32),
+        "doclen": doclen,
+    })
+
+def _with_vocab(idx: dict) -> dict:
+    idx["vocab"] = {t: i for i, t in enumerate(idx["terms"].tolist())}
+    idx["total_len"] = float(idx["doclen"].sum())
+    return idx
+
+def save(idx: dict, path: str):
+    np.savez(path, **{k: idx[k] for k in ("terms", "indptr", "rows", "tfs", "doclen")})
+
+def load(path: str) -> dict:
+    with np.load(path) as z:
+        return _with_vocab({k: z[k] for k in z.files})
+
+def df(idx: dict, term: str) -> int:
+    i = idx["vocab"].get(term)
+    return 0 if i is None else int(idx["indptr"][i+1] - idx["indptr"][i])
+
+def score(idx: dict, terms: list, idf: dict, avgdl: float):
+    """Dense BM25 score per row of the segment (0 where no query term occurs)."""
+    scores = np.zeros(len(idx["doclen"]), dtype=np.float32)
+    for t in terms:
+        i = idx["vocab"].get(t)
+        if i is None:
+            continue
+        s, e = idx["indptr"][i], idx["indptr"][i+1]
+        rows, tf = idx["rows"][s:e], idx["tfs"][s:e]
+        norm = K1 * (1 - B + B * idx["doclen"][rows] / (avgdl or 1.0))
+        scores[rows] += idf[t] * tf * (K1 + 1) / (tf + norm)
+    return scores
+
+def coverage(idx: dict, terms: list, idf: dict, rows) -> np.ndarray:
+    """Share of the query's idf weight whose terms occur in each of `rows` (0..1)."""
+    rows = np.asarray(rows)
+    got = np.zeros(len(rows), dtype=np.float32)
+    for t in terms:
+        i = idx["vocab"].get(t)
+        if i is not None:
+            got += idf[t] * np.isin(rows, idx["rows"][idx["indptr"][i]:idx["indptr"][i+1]])
+    return got / (sum(idf[t] for t in terms) or 1.0)
+
+def idf(n_docs: int, dfs: dict) -> dict:
+    return {t: float(np.log(1 + (n_docs - d + 0.5) / (d + 0.5))) for t, d in dfs.items()}
@@ -0,0 +1,156 @@
+"""
+RAG Store — segmented on-disk layout of the RAG index.
+  <dir>/manifest.json        live segment names + tombstones; replaced atomically (the commit point)
+  <dir>/.lock                flock()ed by whichever process is changing the manifest
+  <dir>/seg_000001/          one immutable segment per write:
+      embeddings.npy         unit-normalized vectors (float32 or float16), memory-mapped on load
+      chunks.jsonl           one {"text", "metadata"} object per row, same order as the vectors
+      ann.npz                optional IVF index over this segment (see rag_ann)
+      sparse.npz             inverted index for BM25 keyword search (see rag_sparse)
+      codes.npy, scales.npy  optional int8 quantized copy of the vectors (see rag_quant)
+      meta.json              row count / dtype, written last so a torn segment is detectable
+Segments are never rewritten: deletes are tombstoned row numbers in the manifest, and
+compaction writes a merged segment before swapping it into the manifest.
+Every manifest write bumps its `generation`, which is how other processes sharing the
+directory notice they need to attach new segments.
+"""
+import os, json, shutil, uuid, threading
+from contextlib import contextmanager
+import numpy as np
+try:
+    import fcntl
+except ImportError:   # Windows: single-process use only
+    fcntl = None
+from backend import rag_ann, rag_sparse, rag_quant
+
+MANIFEST_FILE = "manifest.json"
+VEC_FILE, CHUNK_FILE, ANN_FILE, META_FILE = "embeddings.npy", "chunks.jsonl", "ann.npz", "meta.json"
+SPARSE_FILE = "sparse.npz"
+LOCK_FILE = ".lock"
+_held = threading.local()
+
+def _write_json(path: str, obj):
+    with open(path + ".tmp", "w") as f:
+        json.dump(obj, f)
+    os.replace(path + ".tmp", path)
+
+# ── Manifest ──────────────────────────────────────────────────────────────────
+
+def new_manifest(model: str = "", dtype: str = "float32") -> dict:
+    return {"model": model, "dtype": dtype, "next_id": 1, "segments": [], "tombstones": {},
+            "index_id": uuid.uuid4().hex, "generation": 0}
+
+def read_manifest(path: str) -> dict:
+    p = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(p):
+        return None
+    with open(p) as f:
+        return json.load(f)
+
+def write_manifest(path: str, manifest: dict):
+    os.makedirs(path, exist_ok=True)
+    manifest["generation"] = manifest.get("generation", 0) + 1
+    _write_json(os.path.join(path, MANIFEST_FILE), manifest)
+
+def manifest_stamp(path: str):
+    """Cheap change check: (mtime_ns, size) of the manifest, or None if there is none."""
+    try:
+        st = os.stat(os.path.join(path, MANIFEST_FILE))
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+@contextmanager
+def locked(path: str):
+    """Exclusive inter-process lock on the index directory; re-entrant within a thread."""
+    depth = getattr(_held, "depth", 0)
+    _held.depth = depth + 1
+    f = None
+    try:
+        if depth == 0 and fcntl is not None:
+            os.makedirs(path, exist_ok=True)
+            f = open(os.path.join(path, LOCK_FILE), "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+    finally:
+        _held.depth = depth
+        if f is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+def next_segment_name(manifest: dict) -> str:
+    name = f"seg_{manifest['next_id']:06d}"
+    manifest["next_id"] += 1
+    return name
+
+# ── Segments ──────────────────────────────────────────────────────────────────
+
+def write_segment(path: str, name: str, docs: list, vecs, ann: dict = None, sparse: dict = None,
+                  dtype: str = "float32"):
+    seg = os.path.join(path, name)
+    os.makedirs(seg, exist_ok=True)
+    with open(os.path.join(seg, VEC_FILE), "wb") as f:
+        np.save(f, np.asarray(vecs, dtype=dtype))
+    with open(os.path.join(seg, CHUNK_FILE), "w", encoding="utf-8") as f:
+        for d in docs:
+            f.write(json.dumps({"text": d["text"], "metadata": d["metadata"]}, ensure_ascii=False) + "\n")
+    if ann is not None:
+        rag_ann.save(ann, os.path.join(seg, ANN_FILE))
+    if sparse is not None:
+        rag_sparse.save(sparse, os.path.join(seg, SPARSE_FILE))
+    _write_json(os.path.join(seg, META_FILE), {"dtype": dtype, "count": len(docs)})
+
+def read_segment(path: str, name: str):
+    """Return (docs, vecs, ann, sparse); vecs is a read-only memmap, ann/sparse may be None."""
+    seg = os.path.join(path, name)
+    with open(os.path.join(seg, META_FILE)) as f:
+        meta = json.load(f)
+    vecs = open_vectors(path, name)
+    with open(os.path.join(seg, CHUNK_FILE), encoding="utf-8") as f:
+        docs = [json.loads(line) for line in f if line.strip()]
+    if len(docs) != meta["count"] or len(vecs) != meta["count"]:
+        raise ValueError(f"RAG segment {name} is inconsistent ({len(docs)} chunks, {len(vecs)} vectors)")
+    ann_path = os.path.join(seg, ANN_FILE)
+    ann = rag_ann.load(ann_path) if os.path.exists(ann_path) else None
+    sparse_path = os.path.join(seg, SPARSE_FILE)
+    sparse = rag_sparse.load(sparse_path) if os.path.exists(sparse_path) else None
+    return docs, vecs, ann, sparse
+
+def open_vectors(path: str, name: str):
+    """Read-only memmap of a segment's vectors; every process mapping it shares the page cache."""
+    return np.load(os.path.join(path, name, VEC_FILE), mmap_mode="r")
+
+def write_segment_ann(path: str, name: str, ann: dict):
+    ann_path = os.path.join(path, name, ANN_FILE)
+    if ann is not None:
+        rag_ann.save(ann, ann_path)
+    elif os.path.exists(ann_path):
+        os.remove(ann_path)
+
+def write_segment_codes(path: str, name: str, qz: dict):
+    rag_quant.save(qz, os.path.join(path, name))
+
+def read_segment_codes(path: str, name: str):
+    return rag_quant.load(os.path.join(path, name))
+
+def write_segment_sparse(path: str, name: str, sparse: dict):
+    rag_sparse.save(sparse, os.path.join(path, name, SPARSE_FILE))
+
+def remove_segment(path: str, name: str):
+    shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def migrate_flat(path: str) -> bool:
+    """Move a single-directory store (embeddings.npy etc. at the top level) into seg_000000."""
+    if read_manifest(path) is not None or not os.path.exists(os.path.join(path, META_FILE)):
+        return False
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    seg = os.path.join(path, "seg_000000")
+    os.makedirs(seg, exist_ok=True)
+    for fn in (VEC_FILE, CHUNK_FILE, ANN_FILE, META_FILE):
+        if os.path.exists(os.path.join(path, fn)):
+            os.replace(os.path.join(path, fn), os.path.join(seg, fn))
+    manifest = new_manifest(meta.get("model", ""), meta.get("dtype", "float32"))
+    manifest["segments"].append("seg_000000")
+    write_manifest(path, manifest)
+    return True
@@ -17,6 +17,27 @@ AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4")
 AZURE_OPENAI_API_VERSION= os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01")
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.2"))
 LLM_MAX_TOKENS  = int(os.getenv("LLM_MAX_TOKENS", "1500"))
+GROQ_BASE_URL   = os.getenv("GROQ_BASE_URL", "https://api.groq.com")   # any OpenAI-compatible server under /openai/v1
+LLM_TIMEOUT     = float(os.getenv("LLM_TIMEOUT", "15"))          # seconds per LLM call
+LLM_EXTRACT_TIMEOUT = float(os.getenv("LLM_EXTRACT_TIMEOUT", "8"))   # JSON field extraction; falls back to heuristics
+LLM_POOL_SIZE   = int(os.getenv("LLM_POOL_SIZE", "10"))          # kept-alive connections to the LLM API
+CHAT_LATENCY_BUDGET = float(os.getenv("CHAT_LATENCY_BUDGET", "20"))   # seconds of LLM time per chat turn, 0 = none
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))    # consecutive failures that open the breaker, 0 = off
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds the provider is skipped once open
+LLM_ASYNC       = os.getenv("LLM_ASYNC", "true").lower() == "true"   # route calls through backend/llm_async.py
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))    # upstream calls at once (provider rate limit)
+LLM_QUEUE_MAX   = int(os.getenv("LLM_QUEUE_MAX", "64"))             # callers waiting for a slot before LLMBusy
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))     # seconds to wait for a slot, 0 = no limit
+# Persistent response cache (app database) for deterministic prompts, opt-in per call site
+LLM_CACHE_SQL            = os.getenv("LLM_CACHE_SQL", "false").lower() == "true"             # generate_sql
+LLM_CACHE_JIRA_EXTRACT   = os.getenv("LLM_CACHE_JIRA_EXTRACT", "false").lower() == "true"    # JIRA_CREATE field extraction
+LLM_CACHE_HELPDESK_EXTRACT = os.getenv("LLM_CACHE_HELPDESK_EXTRACT", "false").lower() == "true"  # HELPDESK ticket extraction
+LLM_CACHE_TTL         = float(os.getenv("LLM_CACHE_TTL", "604800"))   # seconds, 0 = no expiry
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))  # least recently used evicted beyond this
+ANSWER_CACHE    = os.getenv("ANSWER_CACHE", "true").lower() == "true"   # reuse answers to near-duplicate questions
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL  = float(os.getenv("ANSWER_CACHE_TTL", "3600"))      # seconds, 0 = no expiry
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))  # min cosine to a cached query
 
 # Database
 DB_BACKEND  = os.getenv("DB_BACKEND", "sqlite")
@@ -24,9 +45,46 @@ SQLITE_PATH = os.getenv("SQLITE_PATH", "data/superbot.db")
 
 # RAG
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")  # sentence-transformers | hashing
+EMBEDDING_DIM   = int(os.getenv("EMBEDDING_DIM", "384"))      # hashing backend only
 RAG_TOP_K       = int(os.getenv("RAG_TOP_K", "4"))
-RAG_INDEX_PATH  = os.getenv("RAG_INDEX_PATH", "data/rag_index.pkl")
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", str(RAG_TOP_K * 1500)))   # prompt budget for retrieved text (fits RAG_TOP_K 600-word chunks), 0 = no limit
+RAG_CONTEXT_DEDUP  = float(os.getenv("RAG_CONTEXT_DEDUP", "0.8"))   # drop chunks this contained in one already kept, 0 = off
+RAG_INDEX_PATH  = os.getenv("RAG_INDEX_PATH", "data/rag_index")   # directory, see backend/rag_store.py
+RAG_VECTOR_DTYPE = os.getenv("RAG_VECTOR_DTYPE", "float32")  # float32 | float16 (half the memory)
+RAG_VECTOR_QUANT = os.getenv("RAG_VECTOR_QUANT", "none")      # none | int8 (scan int8 codes, re-rank in float)
+RAG_QUANT_RERANK = int(os.getenv("RAG_QUANT_RERANK", "4"))    # int8 shortlist = top_k x this
 HR_PDF_DIR      = os.getenv("HR_PDF_DIR", "data/hr_policies")
+RAG_KB_ARTIFACT_DIR = os.getenv("RAG_KB_ARTIFACT_DIR", "data/docs/kb_vectors")  # python -m backend.rag_artifact
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "auto")        # auto | exact | ivf
+RAG_ANN_MIN_DOCS = int(os.getenv("RAG_ANN_MIN_DOCS", "20000")) # auto: exact search below this
+RAG_IVF_NLIST   = int(os.getenv("RAG_IVF_NLIST", "0"))        # 0 = sqrt(n) buckets
+RAG_IVF_NPROBE  = int(os.getenv("RAG_IVF_NPROBE", "8"))       # more buckets = better recall, slower
+RAG_MAX_SEGMENTS = int(os.getenv("RAG_MAX_SEGMENTS", "8"))    # compaction merges the smallest beyond this
+RAG_COMPACT_TOMBSTONE_RATIO = float(os.getenv("RAG_COMPACT_TOMBSTONE_RATIO", "0.3"))
+RAG_EMBED_CACHE = os.getenv("RAG_EMBED_CACHE", "true").lower() == "true"
+RAG_EMBED_CACHE_PATH = os.getenv("RAG_EMBED_CACHE_PATH", "data/embed_cache.db")
+RAG_QUERY_CACHE_SIZE  = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))   # query vectors kept in memory
+RAG_RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", "512"))   # top-k result lists kept in memory
+RAG_QUERY_CACHE_TTL   = float(os.getenv("RAG_QUERY_CACHE_TTL", "3600"))  # seconds, 0 = no expiry
+RAG_HYBRID      = os.getenv("RAG_HYBRID", "true").lower() == "true"  # fuse BM25 keyword hits with dense hits
+RAG_RRF_K       = int(os.getenv("RAG_RRF_K", "60"))                   # reciprocal rank fusion constant
+RAG_HYBRID_MIN_MATCH = float(os.getenv("RAG_HYBRID_MIN_MATCH", "0.5"))  # idf share of the query a keyword hit must contain to skip the dense cutoff
+RAG_SPARSE_CANDIDATES = int(os.getenv("RAG_SPARSE_CANDIDATES", "100"))
+RAG_SPARSE_PREFILTER_MIN_DOCS = int(os.getenv("RAG_SPARSE_PREFILTER_MIN_DOCS", "100000"))  # 0 = never
+RAG_INGEST_BATCH = int(os.getenv("RAG_INGEST_BATCH", "64"))               # chunks per encoder call
+RAG_INGEST_SEGMENT_ROWS = int(os.getenv("RAG_INGEST_SEGMENT_ROWS", "4096"))  # chunks buffered per segment
+RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))  # bulk-upload parsers
+RAG_SHARED_INDEX = os.getenv("RAG_SHARED_INDEX", "true").lower() == "true"   # pick up other workers' writes
+RAG_SYNC_INTERVAL = float(os.getenv("RAG_SYNC_INTERVAL", "2"))               # seconds between manifest checks
+RAG_SEARCH_SHARDS = int(os.getenv("RAG_SEARCH_SHARDS", str(os.cpu_count() or 1)))  # parallel search threads, 1 = off
+RAG_SEARCH_SHARD_ROWS = int(os.getenv("RAG_SEARCH_SHARD_ROWS", "65536"))   # smallest shard worth a thread
+RAG_EMBED_WORKER = os.getenv("RAG_EMBED_WORKER", "")   # socket path (e.g. data/embed.sock); empty = in-process
+RAG_EMBED_WORKER_AUTOSTART = os.getenv("RAG_EMBED_WORKER_AUTOSTART", "true").lower() == "true"
+RAG_EMBED_WORKER_KEY = os.getenv("RAG_EMBED_WORKER_KEY", "")   # empty = random per-install key in data/embed_worker.key
+RAG_EMBED_WORKER_TIMEOUT = float(os.getenv("RAG_EMBED_WORKER_TIMEOUT", "30"))   # seconds to wait for a reply
+RAG_EMBED_WORKER_WAIT_MS = float(os.getenv("RAG_EMBED_WORKER_WAIT_MS", "5"))   # coalescing window
+RAG_EMBED_WORKER_MAX_BATCH = int(os.getenv("RAG_EMBED_WORKER_MAX_BATCH", "256"))
 
 # Jira
 JIRA_BACKEND = os.getenv("JIRA_BACKEND", "mock")